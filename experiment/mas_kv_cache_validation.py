@@ -3,8 +3,8 @@
 测试场景：相同MAS基础提示词(前缀不变) + 不同Agent角色
 执行流程: 
 1. 维护全局唯一的一个LLMClient和LLMContext对象
-2. 设置MAS基础提示词（固定前缀）
-3. 循环测试不同Agent角色(3次)
+2. 设置MAS基础提示词（固定前缀），优先通过mmap从磁盘恢复上次保存的前缀上下文
+3. 使用asyncio.gather并发测试不同Agent角色(3次)，每个请求使用前缀上下文的独立副本
    -->发送任务请求-->记录响应时间-->精确清理非前缀部分-->验证前缀完整性
 4.分析缓存效果
 
@@ -39,19 +39,49 @@
 
 import time
 import json
-import statistics
+import asyncio
+import functools
 import yaml
 import os
 from typing import List, Dict, Any
+
+try:
+    import orjson  # 可选依赖，安装后用于更快地写出结果文件
+except ImportError:
+    orjson = None
+
+try:
+    import xxhash  # 可选依赖，安装后用于更快地计算提示词内容哈希
+except ImportError:
+    xxhash = None
+
 from mas.agent.base.llm_base import LLMClient, LLMContext
 from mas.agent.configs.llm_config import LLMConfig
 from mas.agent.base.executor_base import Executor
 
+def content_hash(content: str) -> int:
+    """计算提示词内容的哈希，优先使用xxhash，未安装时回退到内置hash"""
+    if xxhash is not None:
+        return xxhash.xxh64_intdigest(content.encode("utf-8"))
+    return hash(content)
+
+
+@functools.lru_cache(maxsize=None)
+def _load_agent_config_cached(config_path: str, mtime: float) -> Dict[str, Any]:
+    """
+    按(路径, 修改时间)缓存解析后的Agent配置，同一配置文件只读取并解析一次，
+    避免重复的磁盘读取与YAML解析干扰响应时间的测量；文件被修改后会重新加载。
+    """
+    with open(config_path, "r", encoding="utf-8") as f:
+        return yaml.safe_load(f)
+
+
 class MASFocusedKVCacheTest(Executor):
     """专注测试MAS基础提示词缓存效果的验证器"""
     
-    def __init__(self, config_path: str):
+    def __init__(self, config_path: str, prefix_cache_path: str = "mas_prefix.kv"):
         self.config = LLMConfig.from_yaml(config_path)
+        self.prefix_cache_path = prefix_cache_path  # MAS前缀上下文的持久化文件
         self.llm_client = LLMClient(self.config)
         self.test_results = []
         
@@ -64,10 +94,12 @@ class MASFocusedKVCacheTest(Executor):
         return {"step_id": step_id, "result": "KVCache测试", "status": "finished"}
 
     def load_agent_config(self, agent_config: str) -> Dict[str, Any]:
-        """加载Agent配置文件"""
+        """
+        加载Agent配置文件
+        返回的配置字典被多次测试共享，调用方只读不改。
+        """
         config_path = f"mas/role_config/{agent_config}"
-        with open(config_path, "r", encoding="utf-8") as f:
-            return yaml.safe_load(f)
+        return _load_agent_config_cached(config_path, os.path.getmtime(config_path))
 
     def run_focused_test(self):
         """运行KVCache测试"""
@@ -77,109 +109,143 @@ class MASFocusedKVCacheTest(Executor):
         self.test_true_prefix_preservation()
 
 
-    def test_true_prefix_preservation(self):
+    async def _run_one_role(
+        self,
+        i: int,
+        config_file: str,
+        persistent_context: LLMContext,
+        mas_message_ref: Dict[str, str],
+        mas_message_content_hash: int,
+        prefix_block_hashes: List[int],
+        semaphore: asyncio.Semaphore,
+    ):
+        """在前缀上下文的副本上执行单个Agent角色的请求，返回响应时间（出错时返回None）"""
+        try:
+            agent_config = self.load_agent_config(config_file)
+            agent_name = agent_config.get("name", f"Agent{i+1}")
+            agent_role = agent_config.get("role", "未知角色")
+
+            # 构建Agent状态
+            agent_state = {
+                "agent_id": f"agent_{i+1:03d}",
+                "name": agent_name,
+                "role": agent_role,
+                "profile": agent_config.get("profile", "无描述")
+            }
+
+            # 每个并发请求使用独立的上下文副本，只浅拷贝消息列表，前缀消息对象与持久上下文共享
+            context = LLMContext(context_size=persistent_context.context_size, block_size=persistent_context.block_size)
+            context.set_history(list(persistent_context.get_history()))
+
+            # 📝 记录添加前的长度，用于后续精确清理
+            initial_length = len(context)
+
+            print(f"\n  🔄 第{i+1}次测试: {agent_name} ({agent_role})")
+            print(f"     开始前Context长度: {initial_length}")
+
+            agent_role_prompt = self.get_agent_role_prompt(agent_state)
+            context.add_message("user", agent_role_prompt)
+
+            print(f"     添加角色后Context长度: {len(context)}")
+
+            # 发送任务请求
+            task_prompt = "请根据你的角色制定一个技术项目的执行计划，包括关键步骤和注意事项。"
+
+            async with semaphore:
+                start_time = time.time()
+                response = await self.llm_client.acall(task_prompt, context)
+                end_time = time.time()
+
+            response_time = end_time - start_time
+            print(f"     第{i+1}次响应时间: {response_time:.2f}s")
+
+            # 只删除非前缀部分，保持MAS基础提示词不动
+            # 一次性截断到添加前记录的长度，原地删除后续添加的所有消息
+            context.truncate_to(initial_length)
+
+            # 🔍 验证MAS基础提示词对象是否被动过
+            # 对象未变时内容必然未变，只有对象身份不一致时才回退到对整段提示词重新计算哈希
+            mas_object_unchanged = context.history[0] is mas_message_ref
+            mas_content_unchanged = (
+                mas_object_unchanged
+                or content_hash(context.history[0]["content"]) == mas_message_content_hash
+            )
+            # 前缀的分块哈希链逐块一致，说明整个前缀（不止位置0）的消息内容完全相同
+            prefix_blocks_unchanged = context.block_hashes[:len(prefix_block_hashes)] == prefix_block_hashes
+
+            # if mas_object_unchanged and mas_content_unchanged and prefix_blocks_unchanged:
+            #     print(f"     🎉 MAS基础提示词对象完全未动过！")
+            # else:
+            #     print(f"     ⚠️  MAS基础提示词对象被改动了！")
+
+            return response_time
+        except Exception as e:
+            print(f"  ❌ 处理 {config_file} 时出错: {e}")
+            return None
+
+    def test_true_prefix_preservation(self, max_concurrency: int = 3):
         """真正的前缀保持测试"""
         print("\n📊 测试：真正的MAS前缀保持不变")
         
         # 🔑 关键：设置固定的MAS基础提示词，之后绝不动
-        persistent_context = LLMContext(context_size=30)
-        persistent_context.add_message("user", self.mas_base_prompt)
+        # 优先从磁盘恢复上次运行保存的前缀上下文，不存在或与当前MAS基础提示词不一致时才重新构建并保存
+        # 注意：当前HTTP API无状态，恢复的只是前缀消息本身，待本地部署LLM后可在此基础上复用前缀的KV Cache
+        try:
+            persistent_context = LLMContext.load_mmap(self.prefix_cache_path)
+        except (FileNotFoundError, ValueError, KeyError):
+            persistent_context = None
+        if persistent_context is None or [m["content"] for m in persistent_context.get_history()] != [self.mas_base_prompt]:
+            persistent_context = LLMContext(context_size=30, block_size=1)  # 前缀只有一条消息，按单条消息分块
+            persistent_context.add_message("user", self.mas_base_prompt)
+            persistent_context.save_mmap(self.prefix_cache_path)
+        else:
+            print(f"  💾 已从 {self.prefix_cache_path} 恢复MAS前缀上下文")
 
-        # 📍 记录MAS基础提示词对象的ID，后续验证是否被动过
-        mas_message_id = id(persistent_context.history[0])
-        mas_message_content_hash = hash(persistent_context.history[0]["content"])
+        # 📍 记录MAS基础提示词对象的引用与内容哈希（仅计算一次），后续验证是否被动过
+        mas_message_ref = persistent_context.history[0]
+        mas_message_id = id(mas_message_ref)
+        mas_message_content_hash = content_hash(mas_message_ref["content"])
+        prefix_block_hashes = list(persistent_context.block_hashes)  # 前缀的分块哈希链快照
         
         print(f"  🔒 MAS基础提示词已设置（位置0）")
         print(f"  📏 MAS基础提示词长度: {len(self.mas_base_prompt)} 字符")
         print(f"  🆔 MAS消息对象ID: {mas_message_id}")
         print(f"  #️⃣  MAS内容哈希: {mas_message_content_hash}")
+        print(f"  🧱 前缀哈希块数: {len(prefix_block_hashes)}")
         
         # 加载Agent配置
         agent_configs = ["管理者_灰风.yaml", "管理者_灰风.yaml", "管理者_灰风.yaml"]
-        true_kv_times = []
-        
-        for i, config_file in enumerate(agent_configs):
-            try:
-                agent_config = self.load_agent_config(config_file)
-                agent_name = agent_config.get("name", f"Agent{i+1}")
-                agent_role = agent_config.get("role", "未知角色")
-                
-                # 构建Agent状态
-                agent_state = {
-                    "agent_id": f"agent_{i+1:03d}",
-                    "name": agent_name,
-                    "role": agent_role,
-                    "profile": agent_config.get("profile", "无描述")
-                }
-                
-                print(f"\n  🔄 第{i+1}次测试: {agent_name} ({agent_role})")
-                print(f"     开始前Context长度: {len(persistent_context.get_history())}")
-                
-                # 📝 记录添加前的长度，用于后续精确清理
-                initial_length = len(persistent_context.get_history())
 
-                agent_role_prompt = self.get_agent_role_prompt(agent_state)
-                persistent_context.add_message("user", agent_role_prompt)
-                
-                print(f"     添加角色后Context长度: {len(persistent_context.get_history())}")
-                
-                # 发送任务请求
-                task_prompt = "请根据你的角色制定一个技术项目的执行计划，包括关键步骤和注意事项。"
-                
-                start_time = time.time()
-                response = self.llm_client.call(task_prompt, persistent_context)
-                end_time = time.time()
-                
-                response_time = end_time - start_time
-                true_kv_times.append(response_time)
-                
-                print(f"     响应时间: {response_time:.2f}s")
-                # print(f"     完成后Context长度: {len(persistent_context.get_history())}")
-                
-                # 只删除非前缀部分，保持MAS基础提示词不动
-
-                current_length = len(persistent_context.get_history())
-                message_to_delete = current_length - initial_length
-
-                # print(f"     需要删除的消息数: {message_to_delete}")
+        # 第1个角色请求单独发起，先让服务端缓存MAS前缀；
+        # 完成后再用asyncio.gather并发发起其余角色请求，用Semaphore限制最大并发数，
+        # 这样第1次与后续请求的响应时间对比才能反映前缀缓存的效果
+        async def run_all():
+            semaphore = asyncio.Semaphore(max_concurrency)
+            first = await self._run_one_role(0, agent_configs[0], persistent_context,
+                                             mas_message_ref, mas_message_content_hash, prefix_block_hashes, semaphore)
+            subsequent = await asyncio.gather(*[
+                self._run_one_role(i, config_file, persistent_context,
+                                   mas_message_ref, mas_message_content_hash, prefix_block_hashes, semaphore)
+                for i, config_file in enumerate(agent_configs) if i > 0
+            ])
+            return [first, *subsequent]
 
-                # 逐个删除后续添加的消息
-                for j in range(message_to_delete):
-                    if len(persistent_context.get_history()) > initial_length:
-                        persistent_context.remove_last_message()
-                        # print(f"     已删除第{j+1}条消息, 剩余{len(persistent_context.get_history())}")
-                        
-                final_length = len(persistent_context.get_history())
-                # print(f"     清理完成，最终Context长度: {final_length}")
-
-
-                # 🔍 验证MAS基础提示词对象是否被动过
-                current_mas_id = id(persistent_context.history[0])
-                current_mas_hash = hash(persistent_context.history[0]["content"])
-                
-                mas_object_unchanged = (current_mas_id == mas_message_id)
-                mas_content_unchanged = (current_mas_hash == mas_message_content_hash)
-                
-                # if mas_object_unchanged and mas_content_unchanged:
-                #     print(f"     🎉 MAS基础提示词对象完全未动过！")
-                # else:
-                #     print(f"     ⚠️  MAS基础提示词对象被改动了！")
-                
-                time.sleep(2)
-            except Exception as e:
-                print(f"  ❌ 处理 {config_file} 时出错: {e}")
-                continue
+        # 结果按角色顺序返回，出错的请求返回None，不计入统计
+        role_times = asyncio.run(run_all())
+        first_succeeded = role_times[0] is not None
+        true_kv_times = [t for t in role_times if t is not None]
 
          # 分析KVCache效果
+        avg_time = sum(true_kv_times) / len(true_kv_times) if true_kv_times else 0
         if true_kv_times:
-            avg_time = statistics.mean(true_kv_times)
             print(f"\n  📈 平均时间: {avg_time:.2f}s")
             print(f"  📊 时间范围: {min(true_kv_times):.2f}s - {max(true_kv_times):.2f}s")
             
-            if len(true_kv_times) >= 3:
+            # 第1次请求失败时无法衡量预热前后的差异，跳过效果分析
+            if first_succeeded and len(true_kv_times) >= 3:
                 first_time = true_kv_times[0]
                 subsequent_times = true_kv_times[1:]
-                avg_subsequent = statistics.mean(subsequent_times)
+                avg_subsequent = sum(subsequent_times) / len(subsequent_times)
                 
                 improvement = ((first_time - avg_subsequent) / first_time) * 100
                 
@@ -201,20 +267,26 @@ class MASFocusedKVCacheTest(Executor):
         self.test_results.append({
             "test_name": "absolutely_no_touch_prefix",
             "times": true_kv_times,
-            "average": statistics.mean(true_kv_times) if true_kv_times else 0,
+            "average": avg_time,
             "description": "不动MAS基础提示词对象测试",
-            "strategy": "使用remove_last_message精确清理，MAS对象完全不动"
+            "strategy": "使用truncate_to精确清理，MAS对象完全不动"
         })
         
         # 保存详细结果
-        with open("absolutely_no_touch_kv_cache_results.json", "w", encoding="utf-8") as f:
-            json.dump({
-                "timestamp": time.time(),
-                "test_strategy": "绝对不动MAS基础提示词对象",
-                "mas_object_preservation": "完全保持对象引用不变",
-                "cleanup_method": "remove_last_message逐个删除",
-                "results": self.test_results
-            }, f, indent=2, ensure_ascii=False)
+        results = {
+            "timestamp": time.time(),
+            "test_strategy": "绝对不动MAS基础提示词对象",
+            "mas_object_preservation": "完全保持对象引用不变",
+            "cleanup_method": "truncate_to一次性截断",
+            "results": self.test_results
+        }
+        if orjson is not None:
+            # orjson直接输出UTF-8字节，以二进制模式写入
+            with open("absolutely_no_touch_kv_cache_results.json", "wb") as f:
+                f.write(orjson.dumps(results, option=orjson.OPT_INDENT_2))
+        else:
+            with open("absolutely_no_touch_kv_cache_results.json", "w", encoding="utf-8") as f:
+                json.dump(results, f, indent=2, ensure_ascii=False)
             
 
 
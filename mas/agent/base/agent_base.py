@@ -8,16 +8,52 @@ from mas.agent.state.stage_state import StageState
 from mas.agent.state.sync_state import SyncState
 from mas.utils.async_loop import MCPClientWrapper
 from mas.agent.base.router import Router
+from mas.agent.base.executor_base import Executor
 
 from typing import Any, Dict, Iterable, List, Optional, Type, TypeVar, Union
 import threading
-import time
-import re
+import logging
+import queue
 import json
 import uuid
 
 from types import SimpleNamespace  # 用于将字典转换为对象，便于访问配置文件中的属性
 
+try:
+    import orjson  # 可选依赖，安装后用于更快地解析消息中的指令
+    _json_loads = orjson.loads
+except ImportError:
+    _json_loads = json.loads
+
+
+# 调试日志：将该logger的级别设为DEBUG（并配置handler）后，每个step执行完都会输出所有step_state
+logger = logging.getLogger(__name__)
+
+# 消息中<instruction>指令的起止标签
+INSTRUCTION_OPEN_TAG = "<instruction>"
+INSTRUCTION_CLOSE_TAG = "</instruction>"
+
+# 阶段提示词模板，固定部分只在模块加载时构造一次，get_stage_prompt中只填充变化的字段
+STAGE_PROMPT_TEMPLATE = (
+    "你被分配协助完成当前阶段stage的目标\n"
+    "\n"
+    "当前阶段stage的信息如下：\n"
+    "- 任务ID为：{task_id}\n"
+    "- 阶段ID为：{stage_id}\n"
+    "- 阶段整体目标stage_intention为：{stage_intention}\n"
+    "- 阶段中所有Agent的分配情况agent_allocation为：{agent_allocation}\n"
+    "\n"
+    "**你的所负责的具体目标为**：{agent_goal}\n"
+)
+
+# 常用的step_intention模板，每条消息只需填充发送者ID
+REPLY_INTENTION_TEMPLATE = "回复来自Agent {sender_id}的消息，**消息内容见当前步骤的text_content**"
+PROCESS_INTENTION_TEMPLATE = (
+    "处理来自Agent {sender_id}的消息，**消息内容见当前步骤的text_content**。"
+    "你需要理解、消化并在必要的时候反应该消息的内容（反应是指你需要做出与MAS系统交互的行为），必要的时候需要将重要信息记录在你的persistent_memory中"
+)
+PLANNING_INTENTION = "规划Agent执行当前阶段需要哪些具体step"
+
 
 class AgentBase():
     '''
@@ -31,8 +67,9 @@ class AgentBase():
     - 任务管理（被动触发）
         任务管理用于管理任务进度，保证Agent的可控性。所有的任务管理都通过消息传递，Agent会使用receive_message接收。
         receive_message方法：
-            Agent接收和处理来自其他Agent的不可预知的消息，提供了Agent之间主动相互干预的能力。
-            该方法最终会根据是否需要回复消息走入两个不同的分支，process message分支和send message分支
+            Agent接收来自其他Agent的不可预知的消息，提供了Agent之间主动相互干预的能力。
+            消息放入收件箱后由消息处理线程（message_loop）依次交给handle_message处理，
+            handle_message最终会根据是否需要回复消息走入两个不同的分支，process message分支和send message分支
 
     process_message方法:
         根据解析出的指令的不同进入不同方法
@@ -46,6 +83,9 @@ class AgentBase():
             Agent被分配到新的任务/阶段中时，更新Agent的工作记忆。
 
     '''
+    # 状态监控器中的状态类别，所有Agent子类均归为agent
+    state_kind = "agent"
+
     def __init__(
         self,
         # Agent配置文件,接收已经从yaml解析后的字典
@@ -74,15 +114,62 @@ class AgentBase():
             skills = config.get("skills",[]),  # Agent可用的技能
             llm_config = config.get("llm_config",{}),  # LLM配置
         )
+        # 预先读取Agent可用技能与工具的配置文件，之后组装提示词时直接命中配置缓存
+        Executor.preload_configs(self.agent_state["skills"], self.agent_state["tools"])
+
+        # agent_step、working_memory与step_lock在Agent生命周期内不会被替换，缓存为实例属性，减少执行循环中的字典查找
+        self._agent_step = self.agent_state["agent_step"]
+        self._working_memory = self.agent_state["working_memory"]
+        self._step_lock = self.agent_state["step_lock"]
 
         # 初始化线程锁
-        self.agent_state_lock = threading.Lock()  # 用于步骤锁，防止某个Step等待时插入其他Step执行
+        # 按agent_state的子状态分片加锁，只在修改对应子状态时短暂持有，不在执行器的整个执行过程（如LLM调用）中持有
+        # 同时放入agent_state["state_locks"]，供执行器修改子状态时获取（见Executor.state_lock）
+        # 使用可重入锁，持有锁的线程在执行过程中可再次获取同一把锁
+        # 多把锁总是按该字典的顺序获取，避免死锁
+        self._locks = {
+            "agent_step": threading.RLock(),
+            "working_memory": threading.RLock(),
+            "persistent_memory": threading.RLock(),
+            "step_lock": threading.RLock(),
+        }
+        self.agent_state["state_locks"] = self._locks
+
+        # 消息指令分发表，键为指令字典中的key，值为 handler(payload, message)
+        self._instruction_handlers = {
+            # 指令内容 {"start_stage": {"stage_id": <stage_id> }}  # 由sync_state生成
+            "start_stage": lambda payload, message: self.start_stage(
+                task_id=message["task_id"], stage_id=payload["stage_id"]),
+            # 指令内容 {"finish_stage": {"stage_id": <stage_id> }}  # 由sync_state生成
+            "finish_stage": lambda payload, message: self.finish_stage(
+                task_id=message["task_id"], stage_id=payload["stage_id"]),
+            # 指令内容 {"finish_task": {"task_id": <task_id> }}  # 由sync_state生成
+            "finish_task": lambda payload, message: self.finish_task(
+                task_id=payload["task_id"]),
+            # 指令内容 {"update_working_memory": {"task_id": <task_id>, "stage_id": <stage_id>或None}}
+            "update_working_memory": lambda payload, message: self.update_working_memory(
+                task_id=payload["task_id"], stage_id=payload.get("stage_id", None)),
+            # 指令内容 {"add_tool_decision": {"task_id": <task_id>, "stage_id": <stage_id>,"tool_name": <tool_name>}}
+            "add_tool_decision": lambda payload, message: self.add_tool_decision(
+                task_id=payload["task_id"], stage_id=payload["stage_id"], tool_name=payload["tool_name"]),
+        }
 
         # 启动Agent的执行线程
+        # 执行器的耗时主要在LLM请求与MCP工具调用（I/O等待期间释放GIL），且执行器会原地修改agent_state（包含锁与AgentStep），
+        # 因此使用线程而非进程池执行step
+        self._shutdown = threading.Event()  # 被设置后执行线程在当前step执行完后退出
+        self._step_lock_released = threading.Event()  # 步骤锁中的唯一等待ID被回收时设置，唤醒等待步骤锁的执行线程
         self.action_thread = threading.Thread(target=self.action)
         self.action_thread.daemon = True  # 设置为守护线程，主线程退出时自动退出
         self.action_thread.start()  # 启动执行线程
 
+        # 启动Agent的消息处理线程
+        # receive_message只将消息放入收件箱，由消息处理线程解析消息并添加step，不阻塞消息分发线程
+        self._inbox = queue.SimpleQueue()
+        self.message_thread = threading.Thread(target=self.message_loop)
+        self.message_thread.daemon = True
+        self.message_thread.start()
+
 
     # Agent被实例化时需要初始化自己的 agent_state, agent_state 会被持续维护用于记录Agent的基本信息、状态与记忆。
     # 不同的Agent唯一的区别就是 agent_state 的区别
@@ -104,42 +191,44 @@ class AgentBase():
         所有Agent使用相同的类，具有相同的方法属性，相同的代码构造。
         不同Agent的区别仅有 `Agent State` 的不同，可以通过 `Agent State` 还原出一样的Agent 。
         '''
-        agent_state = {}
-        agent_state["agent_id"] = agent_id  # Agent的唯一标识符
-        agent_state["name"] = name  # Agent的名称
-        agent_state["role"] = role  # Agent的角色
-        agent_state["profile"] = profile  # Agent的角色简介
-
-        # idle 空闲, working 工作中, waiting 等待执行反馈中,
-        agent_state["working_state"] = "idle"  # Agent的当前工作状态
-
-        # 从配置文件中获取 LLM 配置
-        agent_state["llm_config"] = SimpleNamespace(**llm_config)  # LLM配置，使用SimpleNamespace将字典转换为对象，便于llm_base访问
-
-        # Agent工作记忆
-        # Agent工作记忆 {<task_id>: {<stage_id>: [<step_id>,...],...},...} 记录Agent还未完成的属于自己的任务
-        # Agent工作记忆以任务视角，包含多个task，每个task多个stage，每个stage多个step
-        #
-        # 工作记忆step的增加通过AgentBase.add_step或executor_base.add_step
-        # 工作记忆stage和task的增加通过sync_state生成增加指令，由AgentBase.receive_message的process_message分支增加
-        # 注意：工作记忆不要放到提示词里面，提示词里面放持续性记忆
-        agent_state["working_memory"] = working_memory if working_memory else {}
-
-        # 永久追加精简记忆，用于记录Agent的持续性记忆，不会因为任务,阶段,步骤的结束而被清空
-        agent_state["persistent_memory"] = {}  # Key为时间戳 %Y%m%dT%H%M%S ，值为md格式纯文本（里面只能用三级标题 ### 及以下！不允许出现一二级标题！）
-        # {"20250613T103022":"当前我完成了...", "20250613T103523":"当前我正在..."}
-
-        # 初始化AgentStep,用于管理Agent的执行步骤列表
-        # （一般情况下步骤中只包含当前任务当前阶段的步骤，在下一个阶段时，
-        # 上一个阶段的step_state会被同步到stage_state中，不会在列表中留存）
-        agent_state["agent_step"] = AgentStep(agent_id)
-
-        # 步骤锁，由多个唯一ID组成的列表。只有当列表为空，所有的通信唯一等待ID都被回收时，才能取消步骤锁
-        agent_state["step_lock"] = []  # 步骤锁，在通信机制中，如果需要等待消息回复则用过步骤锁暂停step的执行
-
-        # Agent可用的技能与工具库
-        agent_state["tools"] = tools if tools else []
-        agent_state["skills"] = skills if skills else []
+        # agent_state的字段固定，以一个字典字面量一次性构造
+        agent_state = {
+            "agent_id": agent_id,  # Agent的唯一标识符
+            "name": name,  # Agent的名称
+            "role": role,  # Agent的角色
+            "profile": profile,  # Agent的角色简介
+
+            # idle 空闲, working 工作中, waiting 等待执行反馈中,
+            "working_state": "idle",  # Agent的当前工作状态
+
+            # 从配置文件中获取 LLM 配置
+            "llm_config": SimpleNamespace(**llm_config),  # LLM配置，使用SimpleNamespace将字典转换为对象，便于llm_base访问
+
+            # Agent工作记忆
+            # Agent工作记忆 {<task_id>: {<stage_id>: [<step_id>,...],...},...} 记录Agent还未完成的属于自己的任务
+            # Agent工作记忆以任务视角，包含多个task，每个task多个stage，每个stage多个step
+            #
+            # 工作记忆step的增加通过AgentBase.add_step或executor_base.add_step
+            # 工作记忆stage和task的增加通过sync_state生成增加指令，由AgentBase.handle_message的process_message分支增加
+            # 注意：工作记忆不要放到提示词里面，提示词里面放持续性记忆
+            "working_memory": working_memory if working_memory else {},
+
+            # 永久追加精简记忆，用于记录Agent的持续性记忆，不会因为任务,阶段,步骤的结束而被清空
+            "persistent_memory": {},  # Key为时间戳 %Y%m%dT%H%M%S ，值为md格式纯文本（里面只能用三级标题 ### 及以下！不允许出现一二级标题！）
+            # {"20250613T103022":"当前我完成了...", "20250613T103523":"当前我正在..."}
+
+            # 初始化AgentStep,用于管理Agent的执行步骤列表
+            # （一般情况下步骤中只包含当前任务当前阶段的步骤，在下一个阶段时，
+            # 上一个阶段的step_state会被同步到stage_state中，不会在列表中留存）
+            "agent_step": AgentStep(agent_id),
+
+            # 步骤锁，由多个唯一ID组成的集合。只有当集合为空，所有的通信唯一等待ID都被回收时，才能取消步骤锁
+            "step_lock": set(),  # 步骤锁，在通信机制中，如果需要等待消息回复则用过步骤锁暂停step的执行
+
+            # Agent可用的技能与工具库
+            "tools": tools if tools else [],
+            "skills": skills if skills else [],
+        }
 
         return agent_state
 
@@ -167,20 +256,21 @@ class AgentBase():
         # 更新Agent状态为工作中 working
         self.agent_state["working_state"] = "working"
         # 更新step状态为执行中 running
-        self.agent_state["agent_step"].update_step_status(step_id, "running")
+        self._agent_step.update_step_status(step_id, "running")
 
         # 1. 根据Step的executor执行具体的Action，由路由器分发执行
         # 接收一个type和executor的str，返回一个具体执行器
         executor = self.router.get_executor(type=step_type, executor=step_executor)
 
         # 2. 执行路由器返回的执行器
-        with self.agent_state_lock:  # 防止任务分配线程与任务执行线程同时修改agent_state，这里优先保证任务执行线程的修改
-            # 工具executor需要传入MCP Client，技能不需要
-            if step_type == "skill":
-                executor_output = executor.execute(step_id=step_id, agent_state=self.agent_state)  # 这里传入agent_state是因为部分执行器需要具备操作agent本身的能力
-            else:
-                # 如果是工具调用，则需要传入MCPClient
-                executor_output = executor.execute(step_id=step_id, agent_state=self.agent_state, mcp_client_wrapper=self.mcp_client_wrapper)
+        # 这里不加锁：执行器修改agent_step、working_memory、persistent_memory、step_lock时通过 Executor.state_lock 短暂获取对应的锁，
+        # 避免在LLM调用期间阻塞消息处理线程（handle_message）对agent_state的修改
+        # 工具executor需要传入MCP Client，技能不需要
+        if step_type == "skill":
+            executor_output = executor.execute(step_id=step_id, agent_state=self.agent_state)  # 这里传入agent_state是因为部分执行器需要具备操作agent本身的能力
+        else:
+            # 如果是工具调用，则需要传入MCPClient
+            executor_output = executor.execute(step_id=step_id, agent_state=self.agent_state, mcp_client_wrapper=self.mcp_client_wrapper)
 
         # executor_output不应该为None
         assert executor_output is not None, f"[Error][AgentBase] 任何时候都不应该出现executor_output为None的情况！请排查{step_executor}执行器的实现"
@@ -195,42 +285,98 @@ class AgentBase():
         """
         不断从 agent_step.todo_list 获取 step_id 并执行 step_action
         agent_step.todo_list 是一个deque()支持双向插入的队列，用于存放待执行的 step_id
-        对 todo_list.popleft() 到的每个step执行step_action()
+        对 agent_step.pop_todo() 到的每个step执行step_action()，队列为空时阻塞等待
+        调用 stop() 后，执行线程在当前step执行完（或空闲等待超时）后退出
         """
-        agent_step = self.agent_state["agent_step"]
-        while True:
-            if len(self.agent_state["step_lock"]) > 0:
-                # 如果有步骤锁，则等待
+        agent_step = self._agent_step
+        step_lock = self._step_lock
+        while not self._shutdown.is_set():
+            if step_lock:
+                # 如果有步骤锁，则阻塞等待步骤锁被回收（先清除事件再复查，避免错过检查与等待之间的回收）
                 self.agent_state["working_state"] = "waiting"
-                time.sleep(1)
+                self._step_lock_released.clear()
+                if step_lock:
+                    # 设置等待超时只是兜底，步骤锁被回收时会立即唤醒
+                    self._step_lock_released.wait(timeout=5)
                 continue
 
-            # 1. 从agent_state.todo_list获取step_id
-            if agent_step.todo_list:
-                # 如果队列不为空，则获取第一个step_id
-                step_id = agent_step.todo_list.popleft()
-            else:
-                time.sleep(1)  # 队列为空时等待，避免 CPU 空转
+            # 1. 从agent_state.todo_list获取step_id，队列为空时阻塞直到有新的step被添加
+            # 设置等待超时只是为了定期检查停止标志，新的step被添加时会立即唤醒
+            try:
+                step_id = agent_step.pop_todo(timeout=1)
+            except queue.Empty:
                 continue
 
             # 2. 根据step_id获取step_state
-            step_state = agent_step.get_step(step_id)[0]
+            step_state = agent_step.get_step_by_id(step_id)
+            if step_state is None:
+                # 该step在出队前已被移除（例如所属的stage/task已结束），跳过
+                logger.warning("Agent %s 的待执行step %s 已被移除，跳过执行", self.agent_id, step_id)
+                continue
             step_type = step_state.type
             step_executor = step_state.executor
 
             # 3. 执行step_action
-            self.step_action(step_id, step_type, step_executor)
+            # 单个step执行失败（执行器异常等）只记录日志并将该step标记为失败，不能让执行线程退出，否则之后的step都不会再被执行
+            try:
+                self.step_action(step_id, step_type, step_executor)
+            except Exception:
+                logger.exception(
+                    "Agent %s 执行step失败，已将该step标记为failed (step_id=%s, type=%s, executor=%s)",
+                    self.agent_id, step_id, step_type, step_executor,
+                )
+                agent_step.update_step_status(step_id, "failed")
+                self.agent_state["working_state"] = "idle"
 
-            # print("打印所有step_state:")
-            # agent_step.print_all_steps()  # 打印所有step_state
+            # 未开启DEBUG级别时直接跳过，不格式化所有step_state
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("step %s 执行完毕，所有step_state:\n%s", step_id, agent_step.format_all_steps())
+
+    def message_loop(self):
+        """
+        不断从收件箱 self._inbox 中取出消息并交给 handle_message 处理
+        同一Agent的消息按接收顺序依次处理
+        """
+        while not self._shutdown.is_set():
+            # 设置等待超时只是为了定期检查停止标志，有新消息时会立即唤醒
+            try:
+                message, receiver_index = self._inbox.get(timeout=1)
+            except queue.Empty:
+                continue
+            # 单条消息处理失败（如畸形的指令载荷）只记录日志并跳过，不能让消息处理线程退出，否则之后的消息都会积压在收件箱中
+            try:
+                self.handle_message(message, receiver_index)
+            except Exception:
+                logger.exception(
+                    "Agent %s 处理消息失败，已跳过该消息 (task_id=%s, sender_id=%s, return_waiting_id=%s)",
+                    self.agent_id,
+                    message.get("task_id") if isinstance(message, dict) else None,
+                    message.get("sender_id") if isinstance(message, dict) else None,
+                    message.get("return_waiting_id") if isinstance(message, dict) else None,
+                )
+
+    def stop(self):
+        """停止Agent的执行线程与消息处理线程：当前正在执行的step（或正在处理的消息）结束后退出循环"""
+        self._shutdown.set()
+        self._step_lock_released.set()  # 唤醒可能正在等待步骤锁的执行线程
 
     # 上：Agent的执行逻辑
     # ---------------------------------------------------------------------------------------------
     # 下：Agent的任务逻辑
 
-    def receive_message(self, message):
+    def receive_message(self, message, receiver_index: Optional[int] = None):
+        '''
+        接收来自其他Agent的消息（该消息由MAS中的message_dispatcher转发）
+        只将消息放入收件箱后立即返回，由消息处理线程（message_loop）调用handle_message处理
+
+        receiver_index: 自己在message["receiver"]中的位置，由message_dispatcher分发时传入，
+            不传入时在需要时从message["receiver"]中查找
         '''
-        接收来自其他Agent的消息（该消息由MAS中的message_dispatcher转发），
+        self._inbox.put((message, receiver_index))
+
+    def handle_message(self, message, receiver_index: Optional[int] = None):
+        '''
+        处理收件箱中来自其他Agent的消息，
         根据消息内容添加不同的step：
         - 如果需要回复则添加send_message step
             - 如果对方在等待该消息的回复，则解析出对应的唯一等待ID，添加在消息内容中
@@ -250,47 +396,58 @@ class AgentBase():
             "return_waiting_id": <str>,  # 如果消息发送者需要等待回复，则返回消息时填写接收到的消息中包含的来自发送者的唯一等待ID
         }
         '''
+        # 消息在接收边界处只解包一次，后续分支直接使用局部变量
+        task_id = message["task_id"]
+        stage_relative = message["stage_relative"]  # 可能是no_relative 与阶段无关
+        message_text = message["message"]
+        # 消息中携带的返回唯一等待ID，说明自己正在用步骤锁等待这条消息的回复
+        received_waiting_id = message["return_waiting_id"]
+        is_awaited_reply = received_waiting_id is not None and bool(received_waiting_id.strip())
+
         # 1. 判断消息是否需要回复
         if message["need_reply"]:
+            reply_intention = REPLY_INTENTION_TEMPLATE.format(sender_id=message["sender_id"])
 
             # 2. 判断对方是否等待该消息的回复
             if message["waiting"]:
                 # 解析出自己对应的唯一等待ID
-                return_waiting_id = message["waiting"][message["receiver"].index(self.agent_state["agent_id"])]
+                if receiver_index is None:
+                    receiver_index = message["receiver"].index(self.agent_id)
+                return_waiting_id = message["waiting"][receiver_index]
 
                 # 进入到回复消息的分支，为AgentStep插队添加send_message step用于回复。
                 self.add_next_step(
-                    task_id=message["task_id"],
-                    stage_id=message["stage_relative"],  # 可能是no_relative 与阶段无关
-                    step_intention=f"回复来自Agent {message['sender_id']}的消息，**消息内容见当前步骤的text_content**",
+                    task_id=task_id,
+                    stage_id=stage_relative,
+                    step_intention=reply_intention,
                     type="skill",
                     executor="send_message",
-                    text_content=message["message"] + f"\n\n<return_waiting_id>{return_waiting_id}</return_waiting_id>"  # 将消息内容和回应等待ID一起填充
+                    text_content=message_text + f"\n\n<return_waiting_id>{return_waiting_id}</return_waiting_id>"  # 将消息内容和回应等待ID一起填充
                 )
 
             else:
                 # 如果自己等待该消息的回复，则插入添加
-                if message["return_waiting_id"] is not None and message["return_waiting_id"].strip():  # 如果有返回唯一等待ID
+                if is_awaited_reply:  # 如果有返回唯一等待ID
                     # 进入到回复消息的分支，为AgentStep插队添加send_message step用于回复。
                     self.add_next_step(
-                        task_id=message["task_id"],
-                        stage_id=message["stage_relative"],  # 可能是no_relative 与阶段无关
-                        step_intention=f"回复来自Agent {message['sender_id']}的消息，**消息内容见当前步骤的text_content**",
+                        task_id=task_id,
+                        stage_id=stage_relative,
+                        step_intention=reply_intention,
                         type="skill",
                         executor="send_message",
-                        text_content=message["message"]
+                        text_content=message_text
                     )
 
                 # 如果自己不等待该消息的回复，则追加添加
                 else:
                     # 进入到回复消息的分支，为AgentStep添加send_message step用于回复。
                     self.add_step(
-                        task_id = message["task_id"],
-                        stage_id = message["stage_relative"],  # 可能是no_relative 与阶段无关
-                        step_intention = f"回复来自Agent {message['sender_id']}的消息，**消息内容见当前步骤的text_content**",
+                        task_id = task_id,
+                        stage_id = stage_relative,
+                        step_intention = reply_intention,
                         type = "skill",
                         executor = "send_message",
-                        text_content = message["message"]
+                        text_content = message_text
                     )
 
         else:
@@ -298,14 +455,16 @@ class AgentBase():
             self.process_message(message)
 
         # 3. 尝试获取消息中的return_waiting_id，回收步骤锁
-        if message["return_waiting_id"] is not None and message["return_waiting_id"].strip():
-            # 确保要清除的return_waiting_id存在于步骤锁中
-            assert message["return_waiting_id"] in self.agent_state["step_lock"],(
-                f"回收步骤锁失败：return_waiting_id: {message["return_waiting_id"]} 不在 step_lock 中。\n"
-                f"当前 step_lock 内容: {self.agent_state['step_lock']}"
-            )
-            # 回收步骤锁
-            self.agent_state["step_lock"].remove(message["return_waiting_id"])
+        if is_awaited_reply:
+            with self._locks["step_lock"]:
+                # 确保要清除的return_waiting_id存在于步骤锁中
+                assert received_waiting_id in self._step_lock,(
+                    f"回收步骤锁失败：return_waiting_id: {received_waiting_id} 不在 step_lock 中。\n"
+                    f"当前 step_lock 内容: {self._step_lock}"
+                )
+                # 回收步骤锁
+                self._step_lock.discard(received_waiting_id)
+            self._step_lock_released.set()  # 唤醒等待步骤锁的执行线程
 
 
     def process_message(self, message):
@@ -336,15 +495,16 @@ class AgentBase():
         instruction, text = self.extract_instruction(message["message"])
 
         # 1. 对于需要LLM理解并消化的消息，添加process_message step
-        if text:
+        # 去除指令后只剩空白或标点（如"，"、"。"）的消息没有需要理解的内容，不添加step
+        if text and any(c.isalnum() for c in text):
+            process_intention = PROCESS_INTENTION_TEMPLATE.format(sender_id=message["sender_id"])
             # 如果自己正在等待该消息的回复，则插队添加处理该消息的步骤
             if message["return_waiting_id"] is not None:
                 # 说明自己用步骤锁在等待该消息的回复，则插队添加处理该消息的步骤
                 self.add_next_step(
                     task_id=message["task_id"],
                     stage_id=message["stage_relative"],  # 可能是no_relative 与阶段无关
-                    step_intention=f"处理来自Agent {message['sender_id']}的消息，**消息内容见当前步骤的text_content**。"
-                                   f"你需要理解、消化并在必要的时候反应该消息的内容（反应是指你需要做出与MAS系统交互的行为），必要的时候需要将重要信息记录在你的persistent_memory中",
+                    step_intention=process_intention,
                     type="skill",
                     executor="process_message",
                     text_content=message["message"]
@@ -355,8 +515,7 @@ class AgentBase():
                 self.add_step(
                     task_id=message["task_id"],
                     stage_id=message["stage_relative"],  # 可能是no_relative 与阶段无关
-                    step_intention=f"处理来自Agent {message['sender_id']}的消息，**消息内容见当前步骤的text_content**。"
-                                   f"你需要理解、消化并在必要的时候反应该消息的内容（反应是指你需要做出与MAS系统交互的行为），必要的时候需要将重要信息记录在你的persistent_memory中",
+                    step_intention=process_intention,
                     type="skill",
                     executor="process_message",
                     text_content=message["message"]
@@ -364,70 +523,66 @@ class AgentBase():
 
 
 
-        # 2. 如果instruction字典包含start_stage的key,则执行start_stage
-        if instruction and "start_stage" in instruction:
-            # 指令内容 {"start_stage": {"stage_id": <stage_id> }}  # 由sync_state生成
-            task_id = message["task_id"]
-            stage_id = instruction["start_stage"]["stage_id"]
-            self.start_stage(task_id=task_id, stage_id=stage_id)
+        # 2. 根据指令字典中的key分发到对应的处理方法（指令一般只包含一个key）
+        if isinstance(instruction, dict):
+            for key, payload in instruction.items():
+                handler = self._instruction_handlers.get(key)
+                if handler is not None:
+                    handler(payload, message)
 
-        # 3. 如果instruction字典包含finish_stage的key,则执行清除该stage的所有step并且清除相应working_memory
-        if instruction and "finish_stage" in instruction:
-            # 指令内容 {"finish_stage": {"stage_id": <stage_id> }}  # 由sync_state生成
-            task_id = message["task_id"]
-            stage_id = instruction["finish_stage"]["stage_id"]
-            # 清除该stage的所有step
-            self.agent_state["agent_step"].remove_step(stage_id=stage_id)
-            # 清除相应的工作记忆
-            if task_id in self.agent_state["working_memory"]:
-                if stage_id in self.agent_state["working_memory"][task_id]:
-                    del self.agent_state["working_memory"][task_id][stage_id]
-
-        # 4. 如果instruction字典包含finish_task的key,则执行清除该task的所有step并且清除相应working_memory
-        if instruction and "finish_task" in instruction:
-            # 指令内容 {"finish_task": {"task_id": <task_id> }}  # 由sync_state生成
-            task_id = instruction["finish_task"]["task_id"]
-            # 清除该task的所有step
-            self.agent_state["agent_step"].remove_step(task_id=task_id)
-            # 清除相应的工作记忆
-            if task_id in self.agent_state["working_memory"]:
-                del self.agent_state["working_memory"][task_id]
-
-        # 5. 如果instruction字典包含update_working_memory的key,则更新Agent的工作记忆
-        if instruction and "update_working_memory" in instruction:
-            # 指令内容 {"update_working_memory": {"task_id": <task_id>, "stage_id": <stage_id>或None}}
-            task_id = instruction["update_working_memory"]["task_id"]
-            stage_id = instruction["update_working_memory"].get("stage_id", None)
-            self.agent_state["working_memory"].setdefault(task_id, {}).setdefault(stage_id, [])
-        
-        # 6. 如果instruction字典包含add_tool_decision的key,则添加一个Tool Decision步骤
-        if instruction and "add_tool_decision" in instruction:
-            # 指令内容 {"add_tool_decision": {"task_id": <task_id>, "stage_id": <stage_id>,"tool_name": <tool_name>}}
-            task_id = instruction["add_tool_decision"]["task_id"]
-            stage_id = instruction["add_tool_decision"]["stage_id"]
-            tool_name = instruction["add_tool_decision"]["tool_name"]
-            
-            # 准备工具决策步骤的意图描述
-            step_intention = (f"决定长尾工具{tool_name}下一步的执行方向或终止执行。")
-            text_content = (f"该工具{tool_name}返回结果需要向LLM确认，并反复多次调用该工具(这种情况为工具的长尾调用)\n"
-                            f"现在需要处理长尾工具返回的结果并决定下一次工具调用的方向或停止继续调用工具，因此你正在使用该技能ToolDecision。\n"
-                            f"长尾工具以指令生成开始，以工具决策结尾。这一系列步骤示意如下：\n"
-                            f"([InstructionGeneration] -> [Tool]) -> [ToolDecision] -> ([InstructionGeneration] -> [Tool]) -> [ToolDecision] -> ...\n"
-                            f"\n"
-                            f"<tool_name>{tool_name}</tool_name>")
-
-            # 添加Tool Decision步骤
-            self.add_next_step(
-                task_id=task_id,
-                stage_id=stage_id,
-                step_intention=step_intention,
-                type="skill",
-                executor="tool_decision",
-                text_content=text_content  # text_content中包含 <tool_name></tool_name> 包裹的工具名称，用于指示技能执行时获取哪些工具历史结果
-            )
-            
-            print(f"[AgentBase] 已为长尾工具 {tool_name} 添加Tool Decision步骤")
+    def finish_stage(self, task_id: str, stage_id: str):
+        '''
+        清除该stage的所有step并且清除相应working_memory
+        '''
+        # 清除该stage的所有step
+        with self._locks["agent_step"]:
+            self._agent_step.remove_step(stage_id=stage_id)
+        # 清除相应的工作记忆
+        with self._locks["working_memory"]:
+            self._working_memory.get(task_id, {}).pop(stage_id, None)
+
+    def finish_task(self, task_id: str):
+        '''
+        清除该task的所有step并且清除相应working_memory
+        '''
+        # 清除该task的所有step
+        with self._locks["agent_step"]:
+            self._agent_step.remove_step(task_id=task_id)
+        # 清除相应的工作记忆
+        with self._locks["working_memory"]:
+            self._working_memory.pop(task_id, None)
+
+    def update_working_memory(self, task_id: str, stage_id: Optional[str] = None):
+        '''
+        Agent被分配到新的任务/阶段中时，更新Agent的工作记忆
+        '''
+        with self._locks["working_memory"]:
+            self._working_memory.setdefault(task_id, {}).setdefault(stage_id, [])
+
+    def add_tool_decision(self, task_id: str, stage_id: str, tool_name: str):
+        '''
+        为长尾工具插入追加一个Tool Decision步骤
+        '''
+        # 准备工具决策步骤的意图描述
+        step_intention = (f"决定长尾工具{tool_name}下一步的执行方向或终止执行。")
+        text_content = (f"该工具{tool_name}返回结果需要向LLM确认，并反复多次调用该工具(这种情况为工具的长尾调用)\n"
+                        f"现在需要处理长尾工具返回的结果并决定下一次工具调用的方向或停止继续调用工具，因此你正在使用该技能ToolDecision。\n"
+                        f"长尾工具以指令生成开始，以工具决策结尾。这一系列步骤示意如下：\n"
+                        f"([InstructionGeneration] -> [Tool]) -> [ToolDecision] -> ([InstructionGeneration] -> [Tool]) -> [ToolDecision] -> ...\n"
+                        f"\n"
+                        f"<tool_name>{tool_name}</tool_name>")
+
+        # 添加Tool Decision步骤
+        self.add_next_step(
+            task_id=task_id,
+            stage_id=stage_id,
+            step_intention=step_intention,
+            type="skill",
+            executor="tool_decision",
+            text_content=text_content  # text_content中包含 <tool_name></tool_name> 包裹的工具名称，用于指示技能执行时获取哪些工具历史结果
+        )
 
+        print(f"[AgentBase] 已为长尾工具 {tool_name} 添加Tool Decision步骤")
 
     def start_stage(self, task_id: str, stage_id: str):
         '''
@@ -438,23 +593,29 @@ class AgentBase():
         '''
         stage_state = self.sync_state.get_stage_state(task_id=task_id, stage_id=stage_id)
         # Agent从当前StageState来获取信息明确目标
-        agent_id = self.agent_state["agent_id"]
+        agent_id = self.agent_id
         task_id = stage_state.task_id
         stage_id = stage_state.stage_id
 
-        # 1. 构造Agent规划当前阶段的提示词
-        agent_stage_prompt = self.get_stage_prompt(agent_id, stage_state)
-
-        # 2. 如果没有任何step,则增加step_0,一个规划模块
-        if len(self.agent_state["agent_step"].get_step(stage_id=stage_id)) == 0:
-            self.add_step(
-                task_id=task_id,
-                stage_id=stage_id,
-                step_intention=f"规划Agent执行当前阶段需要哪些具体step",
-                type="skill",
-                executor="planning",
-                text_content=agent_stage_prompt
-            )
+        # 该Agent没有被分配到这个阶段时无法构造阶段提示词，记录日志并跳过该阶段
+        if agent_id not in stage_state.agent_allocation:
+            logger.warning("Agent %s 未被分配到阶段 %s (task_id=%s)，跳过开始该阶段", agent_id, stage_id, task_id)
+            return
+
+        # 如果没有任何step,则增加step_0,一个规划模块（检查与添加在同一把锁内完成）
+        with self._locks["agent_step"]:
+            if len(self._agent_step.get_step(stage_id=stage_id)) == 0:
+                # 1. 构造Agent规划当前阶段的提示词（只在需要添加规划step时构造）
+                agent_stage_prompt = self.get_stage_prompt(agent_id, stage_state)
+                # 2. 增加一个规划step
+                self.add_step(
+                    task_id=task_id,
+                    stage_id=stage_id,
+                    step_intention=PLANNING_INTENTION,
+                    type="skill",
+                    executor="planning",
+                    text_content=agent_stage_prompt
+                )
 
     # 上：Agent的任务逻辑
     # ---------------------------------------------------------------------------------------------
@@ -469,51 +630,54 @@ class AgentBase():
             - instruction_dict: JSON指令字典（如果解析失败则为 None）
             - rest_text: 去除该<instruction>后的剩余文本
         '''
-        # 使用正则表达式提取<send_message>和</send_message>之间的内容
-        matches = list(re.finditer(r"<instruction>\s*(.*?)\s*</instruction>", text, re.DOTALL))
+        # 提取最后一个<instruction>和其后第一个</instruction>之间的内容
+        # 从文本末尾反向查找最后一个<instruction>，只从该位置向后查找闭合标签，不扫描前面的全部文本
+        # 如果最后一个<instruction>没有闭合，则继续向前查找
+        start = text.rfind(INSTRUCTION_OPEN_TAG)
+        while start >= 0:
+            close = text.find(INSTRUCTION_CLOSE_TAG, start)
+            if close >= 0:
+                break
+            start = text.rfind(INSTRUCTION_OPEN_TAG, 0, start)
+        if start < 0:
+            # 大部分消息不包含指令，直接返回
+            return None, text.strip()
 
-        if matches:
-            last_match = matches[-1]
-            instruction_text = last_match.group(1)
-            start, end = last_match.span()
+        instruction_text = text[start + len(INSTRUCTION_OPEN_TAG):close].strip()
+        end = close + len(INSTRUCTION_CLOSE_TAG)
 
+        # 指令必须是JSON对象，不以"{"开头的内容直接视为解析失败，不进入JSON解析器
+        if not instruction_text.startswith("{"):
+            print("JSON解析错误:", instruction_text)
+            instruction_dict = None
+        else:
             try:
-                instruction_dict = json.loads(instruction_text)
-            except json.JSONDecodeError:
+                instruction_dict = _json_loads(instruction_text)
+            except json.JSONDecodeError:  # orjson.JSONDecodeError 是 json.JSONDecodeError 的子类
                 print("JSON解析错误:", instruction_text)
                 instruction_dict = None
 
-            # 去掉最后一个 <instruction> ... </instruction> 的文本
-            rest_text = text[:start] + text[end:]
-            return instruction_dict, rest_text.strip()
-        else:
-            return None, text.strip()
+        # 去掉最后一个 <instruction> ... </instruction> 的文本
+        rest_text = text[:start] + text[end:]
+        return instruction_dict, rest_text.strip()
 
 
     def get_stage_prompt(self, agent_id, stage_state):
         '''
         获取当前阶段内容的提示词
         '''
-        md_output = []
-
-        task_id = stage_state.task_id
-        stage_id = stage_state.stage_id
-
-        stage_intention = stage_state.stage_intention  # 整体阶段目标 (str)
         agent_allocation = stage_state.agent_allocation  # 阶段中Agent的分配情况 (Dict[<agent_id>, <agent_stage_goal>])
-        agent_goal = stage_state.agent_allocation[agent_id]  # 阶段中这个Agent自己的目标
-
-        md_output.append("你被分配协助完成当前阶段stage的目标\n")
-        md_output.append(
-            f"当前阶段stage的信息如下：\n,"
-            f"- 任务ID为：{task_id}\n,"
-            f"- 阶段ID为：{stage_id}\n,"
-            f"- 阶段整体目标stage_intention为：{stage_intention}\n,"
-            f"- 阶段中所有Agent的分配情况agent_allocation为：{agent_allocation}\n,"
-        )
-        md_output.append(f"**你的所负责的具体目标为**：{agent_goal}\n")
+        agent_goal = agent_allocation.get(agent_id)  # 阶段中这个Agent自己的目标
+        if agent_goal is None:
+            raise ValueError(f"Agent {agent_id} 未被分配到阶段 {stage_state.stage_id} 中，无法构造阶段提示词")
 
-        return "\n".join(md_output)
+        return STAGE_PROMPT_TEMPLATE.format_map({
+            "task_id": stage_state.task_id,
+            "stage_id": stage_state.stage_id,
+            "stage_intention": stage_state.stage_intention,  # 整体阶段目标 (str)
+            "agent_allocation": agent_allocation,
+            "agent_goal": agent_goal,
+        })
 
 
     def add_step(
@@ -530,35 +694,7 @@ class AgentBase():
         为agent_step的列表中添加一个Step
         '''
         # print(f"[DEBUG][Agent] add_step")
-
-        # 1. 构造一个完整的StepState
-        step_state = StepState(
-            task_id = task_id,
-            stage_id = stage_id,
-            agent_id = self.agent_state["agent_id"],
-            step_intention = step_intention,
-            type = type,
-            executor = executor,
-            execution_state = "init",  # 'init', 'pending', 'running', 'finished', 'failed'
-            text_content = text_content,  # Optional[str]
-            instruction_content = instruction_content,  # Optional[Dict[str, Any]]
-            execute_result = None,  # Optional[Dict[str, Any]]
-        )
-
-        if type == "tool" and instruction_content is None:
-            # 如果是工具调用且没有具体指令，则状态为待填充 pending
-            step_state.update_execution_state("pending")
-
-            # 2. 添加一个该Step到agent_step中
-            self.agent_state["agent_step"].add_step(step_state)
-            # 3. 返回添加的step_id, 记录在工作记忆中
-            self.agent_state["working_memory"].setdefault(task_id, {}).setdefault(stage_id, []).append(step_state.step_id)
-
-        else:
-            # 2. 添加一个该Step到agent_step中
-            self.agent_state["agent_step"].add_step(step_state)
-            # 3. 返回添加的step_id, 记录在工作记忆中
-            self.agent_state["working_memory"].setdefault(task_id, {}).setdefault(stage_id, []).append(step_state.step_id)
+        self._enqueue_step(task_id, stage_id, step_intention, type, executor, text_content, instruction_content, next_step=False)
 
 
     def add_next_step(
@@ -574,34 +710,47 @@ class AgentBase():
         '''
         为agent_step的列表中插队添加一个Step,将该Step直接添加到下一个要处理的step位置上
         '''
+        self._enqueue_step(task_id, stage_id, step_intention, type, executor, text_content, instruction_content, next_step=True)
+
+
+    def _enqueue_step(
+        self,
+        task_id: str,
+        stage_id: str,
+        step_intention: str,
+        type: str,
+        executor: str,
+        text_content: Optional[str],
+        instruction_content: Optional[Dict[str, Any]],
+        next_step: bool,
+    ):
+        '''
+        add_step与add_next_step的共同实现：构造StepState，追加（或插队）到agent_step中，并记录在工作记忆中
+        '''
         # 1. 构造一个完整的StepState
         step_state = StepState(
-                task_id=task_id,
-                stage_id=stage_id,
-                agent_id=self.agent_state["agent_id"],
-                step_intention=step_intention,
-                type=type,
-                executor=executor,
-                execution_state="init",  # 'init', 'pending', 'running', 'finished', 'failed'
-                text_content=text_content,  # Optional[str]
-                instruction_content=instruction_content,  # Optional[Dict[str, Any]]
-                execute_result=None,  # Optional[Dict[str, Any]]
-            )
-
-        if type == "tool" and instruction_content is None:
+            task_id = task_id,
+            stage_id = stage_id,
+            agent_id = self.agent_id,
+            step_intention = step_intention,
+            type = type,
+            executor = executor,
             # 如果是工具调用且没有具体指令，则状态为待填充 pending
-            step_state.update_execution_state("pending")
-
-            # 2. 添加一个该Step到agent_step中,插队到下一个step之前
-            self.agent_state["agent_step"].add_next_step(step_state)
-            # 3. 返回添加的step_id, 记录在工作记忆中
-            self.agent_state["working_memory"][task_id][stage_id].append(step_state.step_id)
+            execution_state = "pending" if type == "tool" and instruction_content is None else "init",  # 'init', 'pending', 'running', 'finished', 'failed'
+            text_content = text_content,  # Optional[str]
+            instruction_content = instruction_content,  # Optional[Dict[str, Any]]
+            execute_result = None,  # Optional[Dict[str, Any]]
+        )
 
-        else:
-            # 2. 添加一个该Step到agent_step中
-            self.agent_state["agent_step"].add_next_step(step_state)
-            # 3. 返回添加的step_id, 记录在工作记忆中
-            self.agent_state["working_memory"].setdefault(task_id, {}).setdefault(stage_id, []).append(step_state.step_id)
+        # 2. 添加一个该Step到agent_step中（插队时添加到下一个step之前）
+        with self._locks["agent_step"]:
+            if next_step:
+                self._agent_step.add_next_step(step_state)
+            else:
+                self._agent_step.add_step(step_state)
+        # 3. 返回添加的step_id, 记录在工作记忆中
+        with self._locks["working_memory"]:
+            self._working_memory.setdefault(task_id, {}).setdefault(stage_id, []).append(step_state.step_id)
 
 
 
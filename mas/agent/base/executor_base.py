@@ -6,13 +6,163 @@ Router类通过type与executor的str返回一个具体执行器，这个执行
 from mas.agent.state.step_state import StepState
 
 from abc import ABC, abstractmethod
+import concurrent.futures
+import contextlib
+import functools
+import itertools
 from typing import Any, Dict, Iterable, List, Optional, Type, TypeVar, Union
 import datetime
-import yaml
+import importlib
 import json5
 import json
 import os
-import re
+import sys
+
+
+def dumps_text(obj) -> str:
+    '''
+    将步骤中的instruction_content/execute_result序列化为提示词中的JSON文本（保留非ASCII字符）
+    提示词文本只使用标准库json.dumps生成，不随是否安装orjson等可选依赖而变化，
+    保证不同部署环境下相同的步骤得到逐字节相同的提示词，不破坏LLM服务端的前缀缓存命中
+    '''
+    return json.dumps(obj, ensure_ascii=False)
+
+
+# LLM回复中持续性记忆块与思考块的起止标签
+PERSISTENT_MEMORY_OPEN_TAG = "<persistent_memory>"
+PERSISTENT_MEMORY_CLOSE_TAG = "</persistent_memory>"
+THINK_OPEN_TAG = "<think>"
+THINK_CLOSE_TAG = "</think>"
+
+
+# 固定结构的提示词模板，固定部分只在模块加载时构造一次，组装时只填充变化的字段
+AGENT_ROLE_PROMPT_TEMPLATE = (
+    "**你是一个智能Agent，具有自己的角色和特点。这个章节agent_role是关于你的身份设定，请牢记它，你接下来任何事情都是以这个身份进行的:**\n"
+    "\n"
+    "**Agent ID(你的ID)**: {agent_id}\n"
+    "**Name(你的名字)**: {name}\n"
+    "**Role(你的角色)**: {role}\n"
+    "**Profile(你的简介)**: {profile}\n"
+    "**你的行为做事逻辑必须严格按照以上角色设定来执行，不能随意更改角色设定。**"
+)
+PERSISTENT_MEMORY_PROMPT_TEMPLATE = (
+    "**这里是你的持续性记忆，它完全由过去的你自己编写，记录了一些过去的你认为非常重要且现在的你可能需要及时查看或参考的信息**(如果是空的则说明过去你还未写入记忆):\n"
+    "\n"
+    "<persistent_memory>{persistent_memory}</persistent_memory>"
+)
+# 当前技能步骤提示词分为随step变化的前半部分和只随技能变化的后半部分，后半部分按技能预先渲染并缓存
+CURRENT_SKILL_STEP_PROMPT_TEMPLATE = (
+    "**这是你当前需要执行的步骤！你将结合背景设定、你的角色agent_role、持续记忆persistent_memory、来遵从当前步骤(本小节'current_step')的提示完成具体目标**:\n"
+    "\n"
+    "**当前步骤的简要意图 step_intention**: {step_intention}\n"
+    "\n"
+    "**当前步骤的文本描述 text_content**: {text_content}\n"
+    "\n"
+)
+CURRENT_SKILL_STEP_SUFFIX_TEMPLATE = (
+    "{skill_prompt}\n"
+    "\n"
+    "**return_format**: {return_format}\n"
+)
+HISTORY_STEP_PROMPT_TEMPLATE = (
+    "[step {idx}]**\n"
+    "- 属性: {type}-{step_intention}\n"
+    "- 意图: {step_intention}\n"
+    "- 文本内容(skills): {text_content}\n"
+    "- 指令内容: {instruction_content}\n"
+    "- 执行结果: {execute_result}\n"
+    "- 执行状态: {execution_state}\n"
+)
+
+
+def registry_key(executor_type: str, executor_name: str) -> str:
+    '''
+    执行器注册表的键 "type:executor_name"，驻留（intern）后同一执行器的键为同一对象，查找时直接命中身份比较
+    '''
+    return sys.intern(f"{executor_type}:{executor_name}")
+
+
+@functools.lru_cache(maxsize=None)
+def _load_yaml_cached(path: str, mtime: float):
+    '''
+    读取并解析YAML文件，按 (路径, 修改时间) 缓存解析结果
+    文件在磁盘上被修改后修改时间变化，会自动重新解析
+    返回的字典为所有调用方共享，调用方只读不修改
+    '''
+    import yaml  # 延迟导入，首次读取配置时才加载yaml
+    # PyYAML编译了libyaml时使用C实现的CSafeLoader，否则回退到纯Python的SafeLoader（两者解析结果一致）
+    loader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+    with open(path, "r", encoding="utf-8") as f:
+        return yaml.load(f, Loader=loader)
+
+
+def load_yaml(path: str):
+    '''
+    读取YAML配置文件（带缓存），文件不存在时抛出 FileNotFoundError
+    '''
+    return _load_yaml_cached(path, os.path.getmtime(path))
+
+
+@functools.lru_cache(maxsize=None)
+def _skill_prompt_fields_cached(path: str, mtime: float):
+    '''
+    从技能配置中一次性取出组装提示词常用的字段，按 (路径, 修改时间) 缓存
+    返回 (skill_name, description, skill_prompt, return_format)，缺省的描述字段为"暂无描述"，缺省的skill_name为None
+    '''
+    config = _load_yaml_cached(path, mtime)
+    use_guide = config.get("use_guide") or {}
+    use_prompt = config.get("use_prompt") or {}
+    return (
+        use_guide.get("skill_name"),
+        use_guide.get("description", "暂无描述"),
+        use_prompt.get("skill_prompt", "暂无描述"),
+        use_prompt.get("return_format", "暂无描述"),
+    )
+
+
+@functools.lru_cache(maxsize=None)
+def _tool_guide_fields_cached(path: str, mtime: float):
+    '''
+    从工具配置中取出使用说明字段，按 (路径, 修改时间) 缓存
+    返回 (tool_name, description)，缺省的描述为"暂无描述"，缺省的tool_name为None
+    '''
+    use_guide = _load_yaml_cached(path, mtime).get("use_guide") or {}
+    return use_guide.get("tool_name"), use_guide.get("description", "暂无描述")
+
+
+@functools.lru_cache(maxsize=None)
+def _skill_step_suffix_cached(path: str, mtime: float) -> str:
+    '''
+    预先渲染技能步骤提示词中只随技能变化的后半部分（技能规则提示与返回格式），按 (路径, 修改时间) 缓存
+    '''
+    _, _, skill_prompt, return_format = _skill_prompt_fields_cached(path, mtime)
+    return CURRENT_SKILL_STEP_SUFFIX_TEMPLATE.format_map({
+        "skill_prompt": skill_prompt,
+        "return_format": return_format,
+    })
+
+
+@functools.lru_cache(maxsize=512)
+def _skill_and_tool_prompt_cached(agent_skills: tuple, agent_tools: tuple) -> str:
+    '''
+    组装技能与工具说明提示词（见 Executor.get_skill_and_tool_prompt），按权限列表缓存
+    '''
+    md_output = []
+    # 获取技能说明
+    if agent_skills:
+        md_output.append("### 可用技能 skills\n")
+        for skill in agent_skills:
+            skill_name, skill_prompt, _, _ = Executor.load_skill_prompt_fields(skill)  # 读取 YAML
+            md_output.append(f"- **{skill_name or skill}**: {skill_prompt}")
+
+    # 处理工具
+    if agent_tools:
+        md_output.append("\n### 可用工具 tools\n")
+        for tool in agent_tools:
+            tool_name, tool_prompt = Executor.load_tool_guide_fields(tool)  # 读取 YAML
+            md_output.append(f"- **{tool_name or tool}**: {tool_prompt}")
+    return "\n".join(md_output)
+
 
 class Executor(ABC):
     '''
@@ -25,20 +175,48 @@ class Executor(ABC):
     通过register方法注册执行器类，register方法接受两个参数，executor_type和executor_name，分别表示执行器的类型和名称
     使用方法：@Executor.register("skill", "planning")
 
-    路由器Routor会通过这个注册表来查找并返回对应的执行器类
+    也可以通过register_lazy只登记执行器所在的模块路径 "module.path:ClassName"，
+    该执行器第一次被路由时才导入模块，导入时模块内的register装饰器会用执行器类覆盖注册表中的路径
+
+    路由器Routor会通过这个注册表（resolve方法）来查找并返回对应的执行器类
     '''
 
-    #注册表：键为 (type, executor_name) 的元组，值为对应的执行器类
-    _registry: Dict[tuple[str, str], type] = {}
+    #注册表：键为 "type:executor_name" 的驻留字符串（见registry_key），值为对应的执行器类，或尚未导入的执行器路径 "module.path:ClassName"
+    _registry: Dict[str, Union[type, str]] = {}
+
+    # 执行器是否可以在所有Agent之间共享同一个实例（不在self上保存执行过程中的状态）
+    # 在self上保存执行状态的执行器需设为False，Router会在每次路由时构造新实例
+    _singleton_safe: bool = True
 
     @classmethod
     def register(cls, executor_type: str, executor_name: str):
         """显式注册执行器类（替代装饰器）"""
         def wrapper(subclass: type):
-            cls._registry[(executor_type, executor_name)] = subclass
+            cls._registry[registry_key(executor_type, executor_name)] = subclass
             return subclass
         return wrapper
 
+    @classmethod
+    def register_lazy(cls, executor_type: str, executor_name: str, target: str):
+        """
+        延迟注册执行器：只登记执行器类的路径 "module.path:ClassName"，不导入模块
+        已经注册过执行器类的键不会被覆盖
+        """
+        cls._registry.setdefault(registry_key(executor_type, executor_name), target)
+
+    @classmethod
+    def resolve(cls, key: str) -> Optional[type]:
+        """
+        返回注册表中键对应的执行器类，未注册时返回None
+        如果该执行器是延迟注册的，则在此时导入其所在模块
+        """
+        executor_class = cls._registry.get(key)
+        if isinstance(executor_class, str):
+            module_path, class_name = executor_class.rsplit(":", 1)
+            executor_class = getattr(importlib.import_module(module_path), class_name)
+            cls._registry[key] = executor_class
+        return executor_class
+
     @abstractmethod
     def execute(self, step_id: str, agent_state: Dict[str, Any], mcp_client = None):
         """
@@ -51,6 +229,47 @@ class Executor(ABC):
         """
         pass
 
+    @staticmethod
+    def state_lock(agent_state: Dict[str, Any], name: str):
+        """
+        获取agent_state子状态（"agent_step", "working_memory", "persistent_memory", "step_lock"）的锁，用于修改该子状态时短暂持有
+        agent_state中没有锁时（例如各执行器的调试入口直接构造的agent_state）返回空的上下文管理器
+        """
+        state_locks = agent_state.get("state_locks")
+        return state_locks[name] if state_locks else contextlib.nullcontext()
+
+    @staticmethod
+    def invalidate_config_cache():
+        """
+        清空YAML配置的解析缓存（文件修改时间变化时会自动重新解析）
+        技能与工具说明提示词按权限列表缓存，不检查文件修改时间，运行中修改了技能或工具配置后需调用本方法
+        """
+        _load_yaml_cached.cache_clear()
+        _skill_and_tool_prompt_cached.cache_clear()
+        _skill_prompt_fields_cached.cache_clear()
+        _skill_step_suffix_cached.cache_clear()
+        _tool_guide_fields_cached.cache_clear()
+
+    @staticmethod
+    def preload_configs(
+        skills: List[str],
+        tools: List[str],
+        skill_config_dir: str = "mas/skills",
+        tool_config_dir: str = "mas/tools/mcp_server_config",
+    ):
+        """
+        一次性并发读取Agent可用技能与工具的YAML配置文件，填充配置解析缓存
+        之后组装提示词时读取配置均直接命中缓存。不存在的配置文件跳过，在实际使用时再报错
+        """
+        config_files = [os.path.join(skill_config_dir, f"{skill}_config.yaml") for skill in skills]
+        config_files += [os.path.join(tool_config_dir, f"{tool}_mcp_config.yaml") for tool in tools]
+        config_files = [path for path in config_files if os.path.exists(path)]
+        if not config_files:
+            return
+        with concurrent.futures.ThreadPoolExecutor(max_workers=min(8, len(config_files))) as pool:
+            # list() 等待全部读取完成，读取失败的异常在此处抛出
+            list(pool.map(load_yaml, config_files))
+
     # 上：基础方法
     # --------------------------------------------------------------------------------------------
     # 下：一些通用工具方法
@@ -64,9 +283,31 @@ class Executor(ABC):
         config_file = os.path.join(config_dir, f"{skill_name}_config.yaml")
         if not os.path.exists(config_file):
             raise ValueError(f"配置文件 {config_file} 不存在！")
-        # 加载YAML文件
-        with open(config_file, "r", encoding="utf-8") as f:
-            return yaml.safe_load(f)
+        # 加载YAML文件（解析结果被缓存，返回的字典只读）
+        return load_yaml(config_file)
+
+    # 读取skill配置中组装提示词常用的字段
+    @staticmethod
+    def load_skill_prompt_fields(skill_name, config_dir="mas/skills"):
+        """
+        返回技能配置中的 (skill_name, description, skill_prompt, return_format)
+        字段在配置文件首次解析后只提取一次，之后直接复用
+        """
+        config_file = os.path.join(config_dir, f"{skill_name}_config.yaml")
+        if not os.path.exists(config_file):
+            raise ValueError(f"配置文件 {config_file} 不存在！")
+        return _skill_prompt_fields_cached(config_file, os.path.getmtime(config_file))
+
+    # 读取skill步骤提示词中只随技能变化的后半部分
+    @staticmethod
+    def load_skill_step_prompt_suffix(skill_name, config_dir="mas/skills"):
+        """
+        返回预先渲染好的技能规则提示与返回格式部分，供 get_current_skill_step_prompt 拼接
+        """
+        config_file = os.path.join(config_dir, f"{skill_name}_config.yaml")
+        if not os.path.exists(config_file):
+            raise ValueError(f"配置文件 {config_file} 不存在！")
+        return _skill_step_suffix_cached(config_file, os.path.getmtime(config_file))
 
     # 加载tool指定的 YAML 配置文件
     def load_tool_config(self, tool_name, config_dir="mas/tools/mcp_server_config"):
@@ -78,9 +319,19 @@ class Executor(ABC):
         config_file = os.path.join(config_dir, f"{tool_name}_mcp_config.yaml")
         if not os.path.exists(config_file):
             raise ValueError(f"配置文件 {config_file} 不存在！")
-        # 加载YAML文件
-        with open(config_file, "r", encoding="utf-8") as f:
-            return yaml.safe_load(f)
+        # 加载YAML文件（解析结果被缓存，返回的字典只读）
+        return load_yaml(config_file)
+
+    # 读取tool配置中的使用说明字段
+    @staticmethod
+    def load_tool_guide_fields(tool_name, config_dir="mas/tools/mcp_server_config"):
+        """
+        返回工具配置中的 (tool_name, description)，组装工具说明提示词时只需要这两个字段
+        """
+        config_file = os.path.join(config_dir, f"{tool_name}_mcp_config.yaml")
+        if not os.path.exists(config_file):
+            raise ValueError(f"配置文件 {config_file} 不存在！")
+        return _tool_guide_fields_cached(config_file, os.path.getmtime(config_file))
 
     # 根据Agent的技能与工具权限 List[str]，组装相应skill与tool的使用说明提示词
     def get_skill_and_tool_prompt(self, agent_skills: List[str], agent_tools: List[str]):
@@ -99,25 +350,8 @@ class Executor(ABC):
             - **<tool_name>**: <tool_prompt>
             - **<tool_name>**: <tool_prompt>
         '''
-        md_output = []
-        # 获取技能说明
-        if agent_skills:
-            md_output.append("### 可用技能 skills\n")
-            for skill in agent_skills:
-                config = self.load_skill_config(skill)  # 读取 YAML
-                skill_name = config["use_guide"].get("skill_name", skill)
-                skill_prompt = config["use_guide"].get("description", "暂无描述")
-                md_output.append(f"- **{skill_name}**: {skill_prompt}")
-
-        # 处理工具
-        if agent_tools:
-            md_output.append("\n### 可用工具 tools\n")
-            for tool in agent_tools:
-                config = self.load_tool_config(tool)  # 读取 YAML
-                tool_name = config["use_guide"].get("tool_name", tool)
-                tool_prompt = config["use_guide"].get("description", "暂无描述")
-                md_output.append(f"- **{tool_name}**: {tool_prompt}")
-        return "\n".join(md_output)
+        # 结果只取决于权限列表（保持列表顺序），按权限列表缓存，权限相同的Agent共享同一份提示词
+        return _skill_and_tool_prompt_cached(tuple(agent_skills or ()), tuple(agent_tools or ()))
 
     # MAS系统的基础提示词
     def get_base_prompt(self, base_prompt="mas/agent/base/base_prompt.yaml", key="system_prompt"):
@@ -125,8 +359,7 @@ class Executor(ABC):
         获取MAS系统的基础提示词, 该方法供子类使用
         获取到yaml文件中以base_prompt为键的值：包含 # 一级标题的md格式文本
         '''
-        with open(base_prompt, "r", encoding="utf-8") as f:
-            return yaml.safe_load(f)[key]
+        return load_yaml(base_prompt)[key]
 
     # MCP调用的基础提示词
     def get_mcp_base_prompt(self, mcp_base_prompt="mas/tools/mcp_base_prompt.yaml", key="mcp_base_prompt"):
@@ -134,43 +367,28 @@ class Executor(ABC):
         获取MCP调用的基础提示词, 该方法供子类使用
         获取到yaml文件中以mcp_base_prompt为键的值：包含 #### 四级标题的md格式文本
         '''
-        with open(mcp_base_prompt, "r", encoding="utf-8") as f:
-            return yaml.safe_load(f)[key]
+        return load_yaml(mcp_base_prompt)[key]
 
     # Role角色提示词
     def get_agent_role_prompt(self, agent_state):
         '''
         组装Agent角色背景提示词，该方法供子类使用
         '''
-        md_output = []
-        md_output.append(
-            "**你是一个智能Agent，具有自己的角色和特点。这个章节agent_role是关于你的身份设定，请牢记它，你接下来任何事情都是以这个身份进行的:**\n"
-        )
-        md_output.append(
-            f"**Agent ID(你的ID)**: {agent_state['agent_id']}\n"
-            f"**Name(你的名字)**: {agent_state['name']}\n"
-            f"**Role(你的角色)**: {agent_state['role']}\n"
-            f"**Profile(你的简介)**: {agent_state['profile']}"
-        )
-        md_output.append("**你的行为做事逻辑必须严格按照以上角色设定来执行，不能随意更改角色设定。**")
-
-
-        return "\n".join(md_output)
+        return AGENT_ROLE_PROMPT_TEMPLATE.format_map({
+            "agent_id": agent_state["agent_id"],
+            "name": agent_state["name"],
+            "role": agent_state["role"],
+            "profile": agent_state["profile"],
+        })
 
     # Agent持续性记忆提示词
     def get_persistent_memory_prompt(self, agent_state):
         '''
         组装Agent持续性记忆提示词，该方法供子类使用
         '''
-        md_output = []
-        md_output.append(
-            "**这里是你的持续性记忆，它完全由过去的你自己编写，记录了一些过去的你认为非常重要且现在的你可能需要及时查看或参考的信息**(如果是空的则说明过去你还未写入记忆):\n"
-        )
-        md_output.append(f"<persistent_memory>"
-                         f"{agent_state['persistent_memory']}"
-                         f"</persistent_memory>")
-
-        return "\n".join(md_output)
+        return PERSISTENT_MEMORY_PROMPT_TEMPLATE.format_map({
+            "persistent_memory": agent_state["persistent_memory"],
+        })
 
     def _remove_json_comments(self, json_str: str) -> str:
         '''
@@ -199,22 +417,30 @@ class Executor(ABC):
         从文本中解析持续性记忆，该方法供子类使用
         持续性记忆是<persistent_memory>List[Dict]</persistent_memory>的形式
         '''
-        # 找到所有 <persistent_memory>...</persistent_memory> 块
-        memory_matches = list(re.finditer(r"<persistent_memory>\s*(.*?)\s*</persistent_memory>", response, re.DOTALL))
-
-        if not memory_matches:
+        # 从文本末尾反向查找最后一个 <persistent_memory>
+        start = response.rfind(PERSISTENT_MEMORY_OPEN_TAG)
+        if start < 0:
             return []
 
         # 找到所有 <think>...</think> 的范围
-        think_spans = [(m.start(), m.end()) for m in re.finditer(r"<think>.*?</think>", response, re.DOTALL)]
+        think_spans = []
+        think_start = response.find(THINK_OPEN_TAG)
+        while think_start >= 0:
+            think_end = response.find(THINK_CLOSE_TAG, think_start + len(THINK_OPEN_TAG))
+            if think_end < 0:
+                break
+            think_end += len(THINK_CLOSE_TAG)
+            think_spans.append((think_start, think_end))
+            think_start = response.find(THINK_OPEN_TAG, think_end)
 
         def is_within_think(pos: int) -> bool:
             return any(start <= pos <= end for start, end in think_spans)
 
-        # 倒序遍历，取最后一个不在<think>内的
-        for match in reversed(memory_matches):
-            if not is_within_think(match.start()):
-                content = match.group(1).strip()
+        # 倒序遍历，取最后一个闭合且不在<think>内的
+        while start >= 0:
+            close = response.find(PERSISTENT_MEMORY_CLOSE_TAG, start + len(PERSISTENT_MEMORY_OPEN_TAG))
+            if close >= 0 and not is_within_think(start):
+                content = response[start + len(PERSISTENT_MEMORY_OPEN_TAG):close].strip()
                 try:
                     content_cleaned = self._remove_json_comments(content)
                     parsed = json.loads(content_cleaned)
@@ -223,6 +449,7 @@ class Executor(ABC):
                 except json.JSONDecodeError:
                     print(f"[extract_persistent_memory] JSON解析失败: {content}")
                     return []
+            start = response.rfind(PERSISTENT_MEMORY_OPEN_TAG, 0, start)
 
         return []  # 如果都在<think>中或格式非法
 
@@ -236,24 +463,25 @@ class Executor(ABC):
             - {"delete": "时间戳"}       → 删除对应 key 的内容
         '''
         memory_dict = agent_state['persistent_memory']
-        for cmd in persistent_memory:
-            if "add" in cmd:
-                content = cmd["add"]
-                timestamp = datetime.datetime.now().strftime("%Y%m%dT%H%M%S")
-                # 避免 key 冲突（如在 1 秒内多次添加）
-                while timestamp in memory_dict:
-                    timestamp = datetime.datetime.now().strftime("%Y%m%dT%H%M%S%f")[:-3]  # 精度提高到毫秒
-                memory_dict[timestamp] = content
-
-            elif "delete" in cmd:
-                del_key = cmd["delete"]
-                if del_key in memory_dict:
-                    del memory_dict[del_key]
-                else:
-                    print(f"[Executor][apply_persistent_memory] 警告：试图删除不存在的时间戳: {del_key}")
+        with self.state_lock(agent_state, "persistent_memory"):
+            for cmd in persistent_memory:
+                if "add" in cmd:
+                    content = cmd["add"]
+                    timestamp = datetime.datetime.now().strftime("%Y%m%dT%H%M%S")
+                    # 避免 key 冲突（如在 1 秒内多次添加）
+                    while timestamp in memory_dict:
+                        timestamp = datetime.datetime.now().strftime("%Y%m%dT%H%M%S%f")[:-3]  # 精度提高到毫秒
+                    memory_dict[timestamp] = content
+
+                elif "delete" in cmd:
+                    del_key = cmd["delete"]
+                    if del_key in memory_dict:
+                        del memory_dict[del_key]
+                    else:
+                        print(f"[Executor][apply_persistent_memory] 警告：试图删除不存在的时间戳: {del_key}")
 
-            else:
-                print(f"[Executor][apply_persistent_memory] 警告：无法识别的指令格式: {cmd}")
+                else:
+                    print(f"[Executor][apply_persistent_memory] 警告：无法识别的指令格式: {cmd}")
 
     # 组装Agent当前执行的skill_step的提示词
     def get_current_skill_step_prompt(self, step_id, agent_state):
@@ -266,22 +494,12 @@ class Executor(ABC):
 
         '''
         step_state = agent_state["agent_step"].get_step(step_id)[0]
-        skill_config = self.load_skill_config(step_state.executor)
+        skill_suffix = self.load_skill_step_prompt_suffix(step_state.executor)
 
-        md_output = []
-        md_output.append(
-            "**这是你当前需要执行的步骤！你将结合背景设定、你的角色agent_role、持续记忆persistent_memory、来遵从当前步骤(本小节'current_step')的提示完成具体目标**:\n"
-        )
-
-        skill_prompt = skill_config["use_prompt"].get("skill_prompt", "暂无描述")
-        return_format = skill_config["use_prompt"].get("return_format", "暂无描述")
-        md_output.append(f"**当前步骤的简要意图 step_intention**: {step_state.step_intention}\n")
-        md_output.append(f"**当前步骤的文本描述 text_content**: {step_state.text_content}\n")
-
-        md_output.append(f"{skill_prompt}\n")
-        md_output.append(f"**return_format**: {return_format}\n")
-
-        return "\n".join(md_output)
+        return CURRENT_SKILL_STEP_PROMPT_TEMPLATE.format_map({
+            "step_intention": step_state.step_intention,
+            "text_content": step_state.text_content,
+        }) + skill_suffix
 
     # 组装历史步骤（已执行和待执行的step）信息提示词
     def get_history_steps_prompt(self, step_id, agent_state):
@@ -290,7 +508,7 @@ class Executor(ABC):
         分别组装已执行与未执行的步骤信息，返回Markdown格式的提示词
 
         通常本方法应用于reflection，summary技能中
-        这里读取step的信息一般都会以str呈现，使用json.dumps()来处理步骤中execute_result与instruction_content
+        这里读取step的信息一般都会以str呈现，使用dumps_text()来处理步骤中execute_result与instruction_content
         '''
         # 获取当前阶段的所有步骤
         agent_step = agent_state["agent_step"]
@@ -302,21 +520,22 @@ class Executor(ABC):
         future_step_md_output = [f"当前阶段的未执行step信息如下:\n"]
         for idx, step in enumerate(history_steps, 1):
             # print("[DEBUG] get_history_steps_prompt 步骤状态: ", step.execution_state)
-            step_info = [
-                f"[step {idx}]**\n",
-                f"- 属性: {step.type}-{step.step_intention}\n",
-                f"- 意图: {step.step_intention}\n",
-                f"- 文本内容(skills): {step.text_content}\n",
-                f"- 指令内容: {json.dumps(step.instruction_content, ensure_ascii=False) if step.instruction_content else '无'}\n",
-                f"- 执行结果: {json.dumps(step.execute_result, ensure_ascii=False) if step.execute_result else '无'}\n",
-                f"- 执行状态: {step.execution_state}\n",
-            ]
-            if step.execution_state in ["finished", "failed"]:
+            if step.execution_state in ("finished", "failed"):
                 # 已执行的步骤
-                history_step_md_output.append("".join(step_info))
+                target = history_step_md_output
+            elif step.execution_state != "running":  # 过滤掉正在执行的步骤，则剩下的是未执行的步骤
+                target = future_step_md_output
             else:
-                if step.execution_state != "running":  # 过滤掉正在执行的步骤，则剩下的是未执行的步骤
-                    future_step_md_output.append("".join(step_info))
+                continue  # 正在执行的步骤不组装
+            target.append(HISTORY_STEP_PROMPT_TEMPLATE.format_map({
+                "idx": idx,
+                "type": step.type,
+                "step_intention": step.step_intention,
+                "text_content": step.text_content,
+                "instruction_content": dumps_text(step.instruction_content) if step.instruction_content else '无',
+                "execute_result": dumps_text(step.execute_result) if step.execute_result else '无',
+                "execution_state": step.execution_state,
+            }))
 
         history_step_md_output.append(f"\n以上是已执行step信息（共 {len(history_step_md_output)-1} 步）")
         future_step_md_output.append(f"\n以上是未执行step信息（共 {len(future_step_md_output)-1} 步）")
@@ -361,84 +580,48 @@ class Executor(ABC):
         history_steps = agent_step.get_step(stage_id=current_step.stage_id)  # 根据当前步骤的stage_id查找所有步骤
 
         # 2 提取当前阶段最近一段连续的 Tool -> ToolDecision 调用链
+        # 以一个状态机从后向前线性扫描一遍所有步骤：
+        #   SEEK_TOOL       寻找最近的第一个 Tool（跳过其他任意步骤）             2.1
+        #   EXPECT_DECISION 从 Tool 向前寻找 ToolDecision（只允许跳过 gap 步骤）  2.2 / 2.4
+        #   SEEK_PAIR_TOOL  从 ToolDecision 向前寻找与之配对的 Tool               2.3
+        # 遇到非法步骤（2.4）或扫描结束（2.5）即终止
+        # 从后向前查找时按倒序追加，查找结束后再统一反转为时间顺序（避免反复在列表头部插入）
         valid_steps = []
-        i = len(history_steps) - 1
-        break_loop = False  # 标记遍量，方便内循环的条件判断不仅打破内循环，且能够打破外循环
-        got_first_tool = False   # 标记是否获取到第一个Tool
-
-        while i >= 0 and not break_loop:
-            step = history_steps[i]
-            # print(f"[DEBUG] 获取到最近的第一个Tool: idx={i}, executor={step.executor}")
-
-            # 2.1 从最近的 Tool 开始（匹配工具名t ool_name）
-            if step.type == "tool" and step.executor == tool_name:
-                valid_steps.insert(0, step)
-                got_first_tool = True   # 标记已经获取到第一个Tool
-                j = i - 1
-
-                # 2.2 向前寻找 ToolDecision
-                # （跳过允许的 gap 步骤）
-                while j >= 0:
-                    td_candidate = history_steps[j]
-                    # print(f"[DEBUG] 当前步骤: idx={j}, executor={td_candidate.executor}")
-
-                    if td_candidate.executor == "tool_decision":
-                        valid_steps.insert(0, td_candidate)
-
-                        # 2.3 ToolDecision 前面一定存在配对的 Tool，直接向前找到最近的一个 Tool 并加入
-                        k = j - 1
-                        while k >= 0:
-                            maybe_tool = history_steps[k]
-                            if maybe_tool.type == "tool" and maybe_tool.executor == tool_name:
-                                valid_steps.insert(0, maybe_tool)
-                                i = k - 1  # 在外循环中继续向前查找下一个 Tool -> ToolDecision 配对
-                                break
-                            else:
-                                k -= 1
-                        else:
-                            # 理论上不该触发：ToolDecision 前没找到 Tool
-                            # print(f"[executor][get_tool_history_prompt]没有找到 ToolDecision 前的 Tool，终止")
-
-                            break_loop = True
-                            i = -1
-                        break
-
-                    elif td_candidate.executor in ["instruction_generation", "send_message"]:
-                        j -= 1  # 跳过 gap 步骤继续找 ToolDecision
-                    else:
-                        # 2.4 遇到非法步骤，说明该工具的连续调用被打断，终止所有循环
-                        break_loop = True
-                        break
-                else:
-                    # 2.5 没有找到更早的 ToolDecision，终止
-                    break_loop = True
+        state = "SEEK_TOOL"
+        for step in reversed(history_steps):
+            is_target_tool = step.type == "tool" and step.executor == tool_name
+            if state == "EXPECT_DECISION":
+                if step.executor == "tool_decision":
+                    valid_steps.append(step)
+                    state = "SEEK_PAIR_TOOL"
+                elif step.executor not in ("instruction_generation", "send_message"):
+                    # 2.4 遇到非法步骤，说明该工具的连续调用被打断，终止
                     break
-            else:
-                # 继续往前找最近一个 Tool 步骤
-                if got_first_tool:
-                    # 如果已经找到第一个 Tool，则不需要再继续往前找了
-                    break_loop = True
-                i -= 1
+                # 否则跳过 gap 步骤继续找 ToolDecision
+            elif is_target_tool:
+                # SEEK_TOOL: 找到最近的第一个 Tool；SEEK_PAIR_TOOL: 找到 ToolDecision 前配对的 Tool
+                # 两种情况都以该 Tool 为新的起点，继续向前寻找 ToolDecision
+                valid_steps.append(step)
+                state = "EXPECT_DECISION"
+            # 否则继续向前寻找 Tool
 
-        # 4 将找到的工具链结构化组装成提示词
-        md_output = []
-        for i, step in enumerate(valid_steps):
-            # 3 获取工具最初调用意图
-            if i == 0:
-                md_output.append(
-                    f"{tool_name}工具最初调用意图：\n"
-                    f"- 步骤意图：{step.step_intention}\n"
-                    f"- 详细说明：{step.text_content}\n"
-                )
-            # 获取工具和工具决策的步骤执行结果
-            md_output.append(
-                f"step：\n"
-                f"- 步骤名称: {step.executor}\n"
-                f"- 执行结果: {json.dumps(step.execute_result, ensure_ascii=False) if step.execute_result else '无'}\n"
-            )
-        # print(f"[DEBUG] 最终组装提示信息，共 {len(md_output)} 段")
+        valid_steps.reverse()
 
-        return "\n".join(md_output)
+        # 4 将找到的工具链结构化组装成提示词
+        # 3 工具最初调用意图取自工具链中的第一个步骤
+        intention = [
+            f"{tool_name}工具最初调用意图：\n"
+            f"- 步骤意图：{valid_steps[0].step_intention}\n"
+            f"- 详细说明：{valid_steps[0].text_content}\n"
+        ] if valid_steps else []
+        # 工具和工具决策的步骤执行结果
+        results = (
+            f"step：\n"
+            f"- 步骤名称: {step.executor}\n"
+            f"- 执行结果: {dumps_text(step.execute_result) if step.execute_result else '无'}\n"
+            for step in valid_steps
+        )
+        return "\n".join(itertools.chain(intention, results))
 
 
     # 组装为tool_step执行指令生成时的提示词
@@ -460,9 +643,7 @@ class Executor(ABC):
 
         # 1.获取instruction_generation的下一个工具step
         tool_step = self.get_next_tool_step(step_id, agent_state)
-        tool_config = self.load_tool_config(tool_step.executor)
-
-        tool_description = tool_config["use_guide"].get("description", "暂无描述")
+        _, tool_description = self.load_tool_guide_fields(tool_step.executor)
 
         # 2.当前工具步骤的简要意图
         md_output.append(f"**当前工具步骤的简要意图**: {tool_step.step_intention}\n")
@@ -486,25 +667,8 @@ class Executor(ABC):
         获取当前步骤之后的下一个工具步骤。
         这个方法查找当前步骤所属阶段（stage_id）的所有工具步骤，并返回下一个工具步骤。
         '''
-        # 1. 获取当前步骤
-        current_step = agent_state["agent_step"].get_step(current_step_id)[0]
-        # print("[DEBUG] 获取到的当前步骤: ", current_step)
-
-        # 2. 获取当前步骤所属阶段的所有步骤
-        all_stage_steps = agent_state["agent_step"].get_step(stage_id=current_step.stage_id)
-        # print("[DEBUG] 当前阶段的所有步骤: ", all_stage_steps)
-
-        # 3. 找到当前步骤在所有步骤中的位置，并从该位置开始寻找下一个工具步骤
-        current_step_found = False
-        for step in all_stage_steps:
-            if current_step_found:
-                # 找到第一个工具步骤并返回
-                if step.type == 'tool':
-                    return step
-            elif step.step_id == current_step_id:
-                # 标记当前步骤已经找到，开始查找下一个工具步骤
-                current_step_found = True
-        return None  # 如果没有找到下一个工具步骤，返回 None
+        # 在当前步骤所属stage的步骤索引中，从当前步骤之后寻找第一个工具步骤（没有找到时返回 None）
+        return agent_state["agent_step"].get_next_step_in_stage(current_step_id, step_type="tool")
 
 
     # 为planning、reflection等技能实现通用add_step的方法
@@ -530,9 +694,9 @@ class Executor(ABC):
         '''
         agent_step = agent_state["agent_step"]
         current_step = agent_step.get_step(step_id)[0]  # 获取当前step的信息
-        for step in planned_step:
-            # 构造新的StepState
-            step_state = StepState(
+        # 构造新的StepState
+        step_states = [
+            StepState(
                 task_id=current_step.task_id,
                 stage_id=current_step.stage_id,
                 agent_id=current_step.agent_id,
@@ -541,10 +705,15 @@ class Executor(ABC):
                 executor=step["executor"],
                 text_content=step["text_content"]
             )
-            # 添加到AgentStep中
-            agent_step.add_step(step_state)
-            # 记录在工作记忆中
-            agent_state["working_memory"].setdefault(current_step.task_id, {}).setdefault(current_step.stage_id, []).append(step_state.step_id)
+            for step in planned_step
+        ]
+        # 批量添加到AgentStep中
+        with self.state_lock(agent_state, "agent_step"):
+            agent_step.add_steps(step_states)
+        # 记录在工作记忆中（同一批step的task_id和stage_id相同，只需定位一次）
+        with self.state_lock(agent_state, "working_memory"):
+            bucket = agent_state["working_memory"].setdefault(current_step.task_id, {}).setdefault(current_step.stage_id, [])
+            bucket.extend(step_state.step_id for step_state in step_states)
 
     # 为tool_decision技能实现通用add_next_step的方法
     def add_next_step(
@@ -569,6 +738,9 @@ class Executor(ABC):
         '''
         agent_step = agent_state["agent_step"]
         current_step = agent_step.get_step(step_id)[0]  # 获取当前step的信息
+        # 工作记忆中当前stage对应的step_id列表，同一批step只需定位一次
+        with self.state_lock(agent_state, "working_memory"):
+            bucket = agent_state["working_memory"].setdefault(current_step.task_id, {}).setdefault(current_step.stage_id, [])
         # 倒序获取
         for step in reversed(planned_step):
             # 构造新的StepState
@@ -582,6 +754,8 @@ class Executor(ABC):
                 text_content=step["text_content"]
             )
             # 插入到AgentStep中
-            agent_step.add_next_step(step_state)
+            with self.state_lock(agent_state, "agent_step"):
+                agent_step.add_next_step(step_state)
             # 记录在工作记忆中
-            agent_state["working_memory"].setdefault(current_step.task_id, {}).setdefault(current_step.stage_id, []).append(step_state.step_id)
+            with self.state_lock(agent_state, "working_memory"):
+                bucket.append(step_state.step_id)
@@ -6,57 +6,269 @@
 '''
 from mas.agent.configs.llm_config import LLMConfig
 
+import asyncio
+import hashlib
+import json
+import mmap
+import os
+import threading
 import requests
-from typing import Dict, Any, Union, List
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import itertools
+from collections import OrderedDict, deque
+from typing import Deque, Dict, Any, Iterator, Union, List
+
+try:
+    import orjson  # 可选依赖，用于更快地序列化请求载荷与解析响应
+except ImportError:
+    orjson = None
+
+try:
+    import xxhash  # 可选依赖，用于更快地计算响应缓存键
+except ImportError:
+    xxhash = None
 
 
 class LLMContext:
     """
     负责维护对话历史，包括追加、删除、获取历史等功能。
+
+    同时维护对话历史的分块哈希链 block_hashes（参照vLLM前缀缓存的做法）：
+        每满 block_size 条消息计算一个块哈希，块哈希包含前一个块的哈希，
+        因此两个上下文前 k 个块哈希相同，即说明前 k * block_size 条消息完全相同。
+        追加消息时增量计算；删除尾部消息时只丢弃受影响的块；
+        头部消息被淘汰（或整体替换历史）时块边界整体移动，只标记失效，到下次读取 block_hashes 时才重算，
+        因此历史已满后的每次追加仍是 O(1)。
     """
 
-    def __init__(self, context_size: int = 30):
+    __slots__ = ("context_size", "history", "block_size", "_block_hashes", "_blocks_stale")
+
+    def __init__(self, context_size: int = 30, block_size: int = 16):
         self.context_size = context_size  # 控制上下文轮数，这里应当由Agent_state传入指定，而非LLM config传入指定，因为LLMContext就是为每个Agent单独维护的
-        self.history: List[Dict[str, str]] = []  # 维护对话历史
+        # 维护对话历史，最多保留最近 context_size 轮（context_size * 2 条消息），追加时自动淘汰最早的消息
+        self.history: Deque[Dict[str, str]] = deque(maxlen=context_size * 2)
+        self.block_size = block_size  # 每个哈希块包含的消息条数
+        self._block_hashes: List[int] = []  # 对话历史中每个完整块的链式哈希
+        self._blocks_stale = False  # 块边界已移动、_block_hashes 需要在读取时重算
+
+    @property
+    def block_hashes(self) -> List[int]:
+        """对话历史中每个完整块的链式哈希，块边界移动后在此处按需重算"""
+        if self._blocks_stale:
+            self._rehash_blocks()
+        return self._block_hashes
+
+    def _hash_block(self, start: int) -> int:
+        """计算从 start 开始的一个完整块的链式哈希"""
+        parent_hash = self._block_hashes[-1] if self._block_hashes else 0
+        block = tuple((msg["role"], msg["content"]) for msg in itertools.islice(self.history, start, start + self.block_size))
+        return hash((parent_hash, block))
+
+    def _rehash_blocks(self):
+        """重新计算全部块哈希"""
+        self._block_hashes = []
+        for start in range(0, len(self.history) - self.block_size + 1, self.block_size):
+            self._block_hashes.append(self._hash_block(start))
+        self._blocks_stale = False
 
     def add_message(self, role: str, content: str):
         """追加新的对话记录"""
         if role not in ["user", "assistant"]:
             raise ValueError("角色必须是 'user' 或 'assistant'")
+        trimmed = len(self.history) == self.history.maxlen  # 历史已满时追加会淘汰最早的消息
         self.history.append({"role": role, "content": content})
-        self.trim_history()  # 控制历史长度
+        if trimmed:
+            self._blocks_stale = True  # 头部消息被淘汰，块边界整体移动，读取时再重算
+        elif not self._blocks_stale and len(self.history) % self.block_size == 0:
+            self._block_hashes.append(self._hash_block(len(self.history) - self.block_size))
 
     def remove_last_message(self):
         """删除最后一条消息"""
         if self.history:
             self.history.pop()
+            del self._block_hashes[len(self.history) // self.block_size:]
 
-    def trim_history(self):
-        """仅保留最近 `context_size` 轮对话"""
-        self.history = self.history[-(self.context_size * 2):]
+    def truncate_to(self, n: int):
+        """截断对话历史，仅保留前 n 条消息（原地截断同一个deque，前缀消息对象保持不变）"""
+        if n < len(self.history):
+            kept = list(itertools.islice(self.history, max(n, 0)))
+            self.history.clear()
+            self.history.extend(kept)
+        del self._block_hashes[len(self.history) // self.block_size:]
 
     def set_history(self, messages: List[Dict[str, str]]):
         """直接替换整个对话历史"""
-        self.history = messages[-(self.context_size * 2):]
+        self.history = deque(messages, maxlen=self.context_size * 2)
+        self._blocks_stale = True
 
-    def get_history(self) -> List[Dict[str, str]]:
-        """获取当前的对话历史"""
+    def get_history(self) -> Deque[Dict[str, str]]:
+        """
+        获取当前的对话历史（返回内部维护的deque本身而非副本，调用方不应直接修改）
+        需要列表时（例如切片或作为请求载荷序列化）请自行 list(...) 转换
+        """
         return self.history
 
+    def __len__(self) -> int:
+        """当前对话历史中的消息条数"""
+        return len(self.history)
+
     def clear(self):
         """清空对话历史"""
-        self.history = []
+        self.history.clear()
+        self._block_hashes = []
+        self._blocks_stale = False
+
+    def save_mmap(self, path: str):
+        """
+        将对话历史持久化到磁盘：
+        - path 中顺序存放所有消息内容的UTF-8字节
+        - path + ".meta" 中以JSON记录 context_size 与每条消息的 (role, 起始偏移, 结束偏移)
+        """
+        boundaries = []
+        offset = 0
+        with open(path, "wb") as f:
+            for msg in self.history:
+                data = msg["content"].encode("utf-8")
+                f.write(data)
+                boundaries.append([msg["role"], offset, offset + len(data)])
+                offset += len(data)
+        with open(path + ".meta", "w", encoding="utf-8") as f:
+            json.dump({"context_size": self.context_size, "block_size": self.block_size, "messages": boundaries}, f)
+
+    @classmethod
+    def load_mmap(cls, path: str) -> "LLMContext":
+        """
+        从 save_mmap 写出的文件恢复对话历史，通过mmap按消息边界切片读取内容。
+        文件不存在时抛出 FileNotFoundError。
+        """
+        with open(path + ".meta", "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        context = cls(context_size=meta["context_size"], block_size=meta.get("block_size", 16))
+        if os.path.getsize(path) == 0:
+            # mmap 不能映射空文件，此时所有消息内容均为空
+            context.set_history([{"role": role, "content": ""} for role, _, _ in meta["messages"]])
+            return context
+        with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            context.set_history([
+                {"role": role, "content": mm[start:end].decode("utf-8")}
+                for role, start, end in meta["messages"]
+            ])
+        return context
 
 
 class LLMClient:
     """
     LLM API 调用封装类，不直接维护对话历史，而是使用 LLMContext。
     该类实现两种API调用方式：Ollama 和 OpenAI。在不同分支中
+
+    可选的客户端响应缓存：
+        当 cache_size > 0 时，以 (模型, 完整对话历史含本次prompt) 的哈希为键缓存回复，
+        前缀与本次prompt完全相同的请求直接返回缓存的回复，不再发起HTTP请求。
+        默认关闭（cache_size=0），因为Agent在相同上下文下重复提问时通常期望得到新的回复。
+        hash_algo 可选 "xxhash"（未安装xxhash时自动回退）或 "sha256"。
     """
 
-    def __init__(self, config: LLMConfig):
+    def __init__(self, config: LLMConfig, cache_size: int = 0, hash_algo: str = "xxhash"):
         self.config = config
 
+        # 客户端响应缓存（LRU）
+        if hash_algo not in ["xxhash", "sha256"]:
+            raise ValueError(f"不支持的哈希算法: {hash_algo}")
+        self.cache_size = cache_size
+        self.hash_algo = hash_algo if xxhash is not None else "sha256"
+        self._response_cache: OrderedDict[str, str] = OrderedDict()
+        self._cache_lock = threading.Lock()  # acall 会在线程池中并发执行 call，需要保护缓存
+
+        # 复用同一个HTTP会话，连接保持keep-alive，后续请求不再重新建立TCP与TLS连接
+        # acall 会在线程池中并发执行 call，连接池需容纳并发请求
+        # 连接失败与429/5xx响应按指数退避重试；POST不在默认允许的方法中，
+        # 因此生成请求只在连接建立失败（请求尚未发出）时重试，不会被重复提交
+        self._session = requests.Session()
+        retries = Retry(
+            total=2,
+            backoff_factor=0.2,
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=Retry.DEFAULT_ALLOWED_METHODS,
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=8, pool_maxsize=16, max_retries=retries)
+        self._session.mount("http://", adapter)
+        self._session.mount("https://", adapter)
+
+    def close(self):
+        """关闭HTTP会话，释放连接池中的连接"""
+        self._session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _get_cache_key(self, context: LLMContext) -> str:
+        """根据模型与对话历史（已包含本次prompt）计算响应缓存键"""
+        hasher = xxhash.xxh64() if self.hash_algo == "xxhash" else hashlib.sha256()
+        hasher.update(str(self.config.model).encode("utf-8"))
+        for msg in context.history:
+            # 用不会出现在正文中的分隔符区分 role 与 content 的边界
+            hasher.update(b"\x00" + msg["role"].encode("utf-8") + b"\x01" + msg["content"].encode("utf-8"))
+        return hasher.hexdigest()
+
+    def clear_cache(self):
+        """清空客户端响应缓存"""
+        with self._cache_lock:
+            self._response_cache.clear()
+
+    def _get_url(self) -> str:
+        """根据 api_type 选择 API 端点"""
+        if self.config.api_type == "ollama":
+            return self.config.base_url + "/chat"  # 使用生成对话模式
+        elif self.config.api_type == "openai":
+            return self.config.base_url + "/chat/completions"  # 使用生成对话模式
+        elif self.config.api_type == "gemini":
+            # Gemini API 需要在 URL 中添加模型名称和 API 密钥
+            return f"{self.config.base_url}/models/{self.config.model}:generateContent?key={self.config.api_key}"
+        else:
+            raise ValueError(f"不支持的 API 类型: {self.config.api_type}")
+
+    def _post(self, url: str, headers: Dict[str, str], payload: Dict[str, Any], stream: bool = False) -> requests.Response:
+        """通过复用的HTTP会话发送请求，安装了orjson时用orjson序列化载荷"""
+        if orjson is not None:
+            # headers中已包含 Content-Type: application/json
+            return self._session.post(url, headers=headers, data=orjson.dumps(payload), timeout=self.config.timeout, stream=stream)
+        return self._session.post(url, headers=headers, json=payload, timeout=self.config.timeout, stream=stream)
+
+    def _iter_stream(self, url: str, headers: Dict[str, str], payload: Dict[str, Any]) -> Iterator[str]:
+        """
+        发送流式请求，逐段返回回复的增量文本
+        - Ollama: 每行一个JSON对象，增量位于 message.content
+        - OpenAI: SSE格式，每个事件为 "data: <JSON>"，增量位于 choices[0].delta.content，以 "data: [DONE]" 结束
+        响应行无法解析为JSON时抛出 requests.exceptions.InvalidJSONError
+        """
+        with self._post(url, headers, payload, stream=True) as response:
+            response.raise_for_status()  # 检查 HTTP 错误
+            for line in response.iter_lines():
+                if not line:
+                    continue
+                if self.config.api_type == "openai":
+                    if not line.startswith(b"data:"):
+                        continue  # 忽略SSE注释与其他字段
+                    line = line[5:].strip()
+                    if line == b"[DONE]":
+                        break
+                try:
+                    data = orjson.loads(line) if orjson is not None else json.loads(line)
+                except ValueError as e:
+                    raise requests.exceptions.InvalidJSONError(f"流式响应解析失败: {e}")
+                if self.config.api_type == "openai":
+                    choices = data.get("choices") or [{}]
+                    delta = (choices[0].get("delta") or {}).get("content")
+                else:
+                    delta = (data.get("message") or {}).get("content")
+                if delta:
+                    yield delta
+
     def _get_headers(self) -> Dict[str, str]:
         """生成 HTTP 头部信息"""
         headers = {"Content-Type": "application/json",}
@@ -78,7 +290,7 @@ class LLMClient:
         if self.config.api_type == "gemini":
             # Gemini API 格式
             gemini_messages = []
-            for msg in context.get_history():
+            for msg in context.history:
                 role = "user" if msg["role"] == "user" else "model"
                 gemini_messages.append({
                     "role": role,
@@ -97,7 +309,7 @@ class LLMClient:
             # OpenAI/Ollama 格式
             payload = {
                 "model": self.config.model,
-                "messages": context.get_history(),  # 使用上下文中的对话历史
+                "messages": list(context.history),  # 使用上下文中的对话历史（deque需转为列表才能序列化）
                 "stream": stream,  # 使用流模式参数
                 "max_tokens": kwargs.get("max_tokens", self.config.max_tokens),
                 "temperature": kwargs.get("temperature", self.config.temperature),
@@ -119,22 +331,14 @@ class LLMClient:
         参数:
             prompt (str): 用户输入的文本。
             context (LLMContext): 对话上下文对象，存储历史对话信息。
-            stream (bool, 可选): 是否使用流式输出，默认为 False。
+            stream (bool, 可选): 是否使用流式请求（逐段接收后拼接为完整回复，Gemini不支持），默认为 False。
             **kwargs: 额外的 API 参数（如 `max_tokens`、`temperature` 等）。
 
         返回:
             Union[str, None]: 生成的文本回复，如果请求失败则返回 None。
         """
         # 1. 选择 API 端点
-        if self.config.api_type == "ollama":
-            url = self.config.base_url + "/chat"  # 使用生成对话模式
-        elif self.config.api_type == "openai":
-            url = self.config.base_url + "/chat/completions"  # 使用生成对话模式
-        elif self.config.api_type == "gemini":
-            # Gemini API 需要在 URL 中添加模型名称和 API 密钥
-            url = f"{self.config.base_url}/models/{self.config.model}:generateContent?key={self.config.api_key}"
-        else:
-            raise ValueError(f"不支持的 API 类型: {self.config.api_type}")
+        url = self._get_url()
 
         # 2. 生成 HTTP 请求头
         headers = self._get_headers()
@@ -142,39 +346,61 @@ class LLMClient:
         # 3. 生成请求载荷
         payload = self._get_payload(prompt, context, stream, **kwargs)
 
-        try:
-            # 4. 发送 HTTP 请求
-            response = requests.post(url, headers=headers, json=payload, timeout=self.config.timeout)
-            response.raise_for_status()  # 检查 HTTP 错误
-            data = response.json()
+        # 如果启用了响应缓存，则前缀与prompt完全相同的请求直接返回缓存的回复
+        cache_key = None
+        if self.cache_size > 0:
+            cache_key = self._get_cache_key(context)
+            with self._cache_lock:
+                reply = self._response_cache.get(cache_key)
+                if reply is not None:
+                    self._response_cache.move_to_end(cache_key)
+            if reply is not None:
+                context.add_message("assistant", reply)
+                return reply
 
-            # 5. 解析 API 响应
-            if self.config.api_type == "ollama":
-                # Ollama API 响应格式
-                if "message" in data and "content" in data["message"]:
-                    reply = data["message"]["content"]
-                else:
-                    print("Ollama API 响应中没有预期的字段")
-                    return None
-            elif self.config.api_type == "openai":
-                # OpenAI API 响应格式
-                if "choices" in data and len(data["choices"]) > 0:
-                    reply = data["choices"][0]["message"]["content"]
-                else:
-                    print("OpenAI API 响应中没有预期的字段")
-                    return None
-            elif self.config.api_type == "gemini":
-                # Gemini API 响应格式
-                if "candidates" in data and len(data["candidates"]) > 0:
-                    reply = data["candidates"][0]["content"]["parts"][0]["text"]
-                else:
-                    print("Gemini API 响应中没有预期的字段")
-                    return None
+        try:
+            if stream and self.config.api_type != "gemini":
+                # 流式请求：逐段读取增量回复并拼接为完整回复
+                reply = "".join(self._iter_stream(url, headers, payload))
             else:
-                raise ValueError(f"不支持的 API 类型: {self.config.api_type}")
+                # 4. 发送 HTTP 请求
+                response = self._post(url, headers, payload)
+                response.raise_for_status()  # 检查 HTTP 错误
+                data = self._parse_response(response)
+
+                # 5. 解析 API 响应
+                if self.config.api_type == "ollama":
+                    # Ollama API 响应格式
+                    if "message" in data and "content" in data["message"]:
+                        reply = data["message"]["content"]
+                    else:
+                        print("Ollama API 响应中没有预期的字段")
+                        return None
+                elif self.config.api_type == "openai":
+                    # OpenAI API 响应格式
+                    if "choices" in data and len(data["choices"]) > 0:
+                        reply = data["choices"][0]["message"]["content"]
+                    else:
+                        print("OpenAI API 响应中没有预期的字段")
+                        return None
+                elif self.config.api_type == "gemini":
+                    # Gemini API 响应格式
+                    if "candidates" in data and len(data["candidates"]) > 0:
+                        reply = data["candidates"][0]["content"]["parts"][0]["text"]
+                    else:
+                        print("Gemini API 响应中没有预期的字段")
+                        return None
+                else:
+                    raise ValueError(f"不支持的 API 类型: {self.config.api_type}")
 
             # 6. 将 AI 生成的回复追加到上下文，并返回
             context.add_message("assistant", reply)
+            if cache_key is not None:
+                with self._cache_lock:
+                    self._response_cache[cache_key] = reply
+                    self._response_cache.move_to_end(cache_key)
+                    while len(self._response_cache) > self.cache_size:
+                        self._response_cache.popitem(last=False)  # 淘汰最久未使用的缓存
             return reply
 
         except requests.exceptions.RequestException as e:
@@ -182,6 +408,65 @@ class LLMClient:
             print(f"API 请求失败: {e}")
             return None
 
+    def call_stream(
+        self,
+        prompt: str,
+        context: LLMContext,
+        **kwargs
+    ) -> Iterator[str]:
+        """
+        流式调用 LLM API，逐段返回回复的增量文本，无需等待完整回复生成。
+        参数同 call。完整回复在流读取结束后追加到上下文；调用方提前停止迭代时不追加。
+        请求失败时打印错误并结束迭代。Gemini API 不支持流式请求，一次性返回完整回复。
+        流式调用不使用客户端响应缓存。
+        """
+        if self.config.api_type == "gemini":
+            reply = self.call(prompt, context, stream=False, **kwargs)
+            if reply is not None:
+                yield reply
+            return
+
+        url = self._get_url()
+        headers = self._get_headers()
+        payload = self._get_payload(prompt, context, True, **kwargs)
+
+        parts = []
+        try:
+            for delta in self._iter_stream(url, headers, payload):
+                parts.append(delta)
+                yield delta
+        except requests.exceptions.RequestException as e:
+            print(f"API 请求失败: {e}")
+            return
+        context.add_message("assistant", "".join(parts))
+
+    @staticmethod
+    def _parse_response(response: requests.Response) -> Any:
+        """
+        解析响应体JSON，安装了orjson时使用orjson
+        orjson解析失败时回退到 response.json()，由其抛出requests的JSON解析异常，与未安装orjson时的异常处理保持一致
+        """
+        if orjson is not None:
+            try:
+                return orjson.loads(response.content)
+            except orjson.JSONDecodeError:
+                pass
+        return response.json()
+
+    async def acall(
+        self,
+        prompt: str,
+        context: LLMContext,
+        stream: bool = False,
+        **kwargs
+    ) -> Union[str, None]:
+        """
+        call 的异步版本，参数与返回值同 call。
+        阻塞的HTTP请求在默认线程池中执行，便于使用 asyncio.gather 并发发起多个请求。
+        注意：并发请求之间不能共享同一个 LLMContext。
+        """
+        return await asyncio.to_thread(self.call, prompt, context, stream, **kwargs)
+
 
 # Debug
 if __name__ == "__main__":
@@ -191,15 +476,15 @@ if __name__ == "__main__":
 
     print("尝试初始化llm并调用")
     config = LLMConfig.from_yaml("mas/agent/configs/test_llm_config.yaml")  # 创建 LLM 配置  mas/role_config/doubao.yaml  mas/role_config/qwq32b.yaml mas/role_config/openai.yaml
-    llm_client = LLMClient(config)  # 创建 LLM 客户端
     chat_context = LLMContext(context_size=3)  # 创建一个对话上下文
 
     # 追加自定义历史记录
     chat_context.add_message("user", "你好")
     chat_context.add_message("assistant", "你好！我是 AI 助手")
 
-    # 调用 LLM
-    response = llm_client.call("请介绍一下自己", context=chat_context)
+    # 调用 LLM，退出 with 块时关闭客户端的HTTP会话
+    with LLMClient(config) as llm_client:  # 创建 LLM 客户端
+        response = llm_client.call("请介绍一下自己", context=chat_context)
     print(response)
 
     # 获取当前的对话历史
@@ -1,28 +1,66 @@
 '''
 这里实现一个Router类:
 Router类根据step_state.type和step_state.executor两个字符串。
-访问Executor的注册表_registry，获取对应执行器类。
+访问Executor的注册表_registry，获取对应执行器类（延迟注册的执行器在此时才导入）。
 并返回实例化后的执行器类。
+
+执行器本身不保存状态，同一执行器在整个进程中只实例化一次，所有Router（每个Agent一个）共享该实例。
+（_singleton_safe 为 False 的执行器除外，每次路由都会构造新实例）
 '''
 
-from mas.agent.base.executor_base import Executor
+from mas.agent.base.executor_base import Executor, registry_key
+
+# 所有工具step在注册表中对应的键
+MCP_TOOL_KEY = registry_key("tool", "mcp_tool")
+
 
 class Router:
 
-    @staticmethod
-    def get_executor(type: str, executor: str) -> Executor:
+    # 绝大多数step都会路由到的执行器，在Router初始化时预先实例化并写入路由表
+    HOT_ROUTES = [("skill", "planning"), ("skill", "send_message"), ("skill", "process_message")]
+
+    # 已实例化的执行器缓存（所有Router共享），键为注册表中的 "type:executor" 字符串
+    _executors = {}
+
+    def __init__(self):
+        # 路由表 {type: {executor: 执行器实例}}，按step中原始的type与executor两级查找，命中时不构造任何键对象
+        # 所有工具step在注册表中都对应同一个mcp_tool执行器，路由表按原始executor名记录，命中时直接返回
+        self._routes = {"skill": {}, "tool": {}}
+
+        # 预热常用执行器（只预热模块已导入的执行器；延迟注册的执行器不在此处导入模块，未注册的在首次使用时再报错）
+        for executor_type, executor_name in self.HOT_ROUTES:
+            if isinstance(Executor._registry.get(registry_key(executor_type, executor_name)), type):
+                self.get_executor(type=executor_type, executor=executor_name)
+
+    def get_executor(self, type: str, executor: str) -> Executor:
         """
         根据 type 和 executor 返回对应的executor实例
         - 如果是技能，则找到对应名称executor的技能执行器
         - 如果是工具，则找到名称为mcp_tool的工具执行器（因为所有的工具均通过该mcp_tool executor来执行，所有的工具均以MCP标准实现）
         """
+        routes = self._routes.get(type)
+        if routes is not None:
+            executor_instance = routes.get(executor)
+            if executor_instance is not None:
+                return executor_instance
+
         # print("[DEBUG][Router] 注册表：", Executor._registry)
-        executor_class = None
         if type == "skill":
-            executor_class = Executor._registry.get((type, executor))
+            key = registry_key(type, executor)
         elif type == "tool":
-            executor_class = Executor._registry.get((type, "mcp_tool"))
+            key = MCP_TOOL_KEY
+        else:
+            key = None
 
-        if not executor_class:
-            raise ValueError(f"未找到对应的执行器: type={type}, executor={executor}")
-        return executor_class()
+        executor_instance = self._executors.get(key)
+        if executor_instance is None:
+            executor_class = Executor.resolve(key)
+            if not executor_class:
+                raise ValueError(f"未找到对应的执行器: type={type}, executor={executor}")
+            if not executor_class._singleton_safe:
+                # 保存执行状态的执行器不共享、不缓存，每次路由都返回新实例
+                return executor_class()
+            # setdefault保证多个Agent线程并发首次实例化时，所有Router拿到的是同一个实例
+            executor_instance = self._executors.setdefault(key, executor_class())
+        routes[executor] = executor_instance
+        return executor_instance
@@ -44,6 +44,9 @@ class LLMType(Enum):  # 定义 LLMType 枚举，表示支持的 LLM 类型
 class LLMConfig:
     """LLM 基础配置类"""
 
+    # 固定属性集合，不为每个配置实例创建__dict__
+    __slots__ = ("api_key", "api_type", "base_url", "model", "max_tokens", "temperature", "timeout")
+
     def __init__(
         self,
         api_key: str,  # API 密钥，用于身份验证
@@ -197,7 +197,7 @@ class HumanAgent(AgentBase):
     # 下：人类操作端消息输入输出接口
 
     # 人类操作端Agent的 receive_message 方法
-    def receive_message(self, message):
+    def receive_message(self, message, receiver_index: Optional[int] = None):
         '''
         接收来自其他Agent的消息（该消息由MAS中的message_dispatcher转发），
         根据消息内容执行相应操作：
@@ -216,6 +216,8 @@ class HumanAgent(AgentBase):
             "waiting": <list>,  # 如果发送者需要等待回复，则为所有发送对象填写唯一等待ID。不等待则为 None
             "return_waiting_id": <str>,  # 如果消息发送者需要等待回复，则返回消息时填写接收到的消息中包含的来自发送者的唯一等待ID
         }
+
+        receiver_index: 自己在message["receiver"]中的位置，由message_dispatcher分发时传入，不传入时从receiver中查找
         '''
 
         print(f"[DEBUG][HumanAgent]receive_message: {message}")
@@ -226,7 +228,9 @@ class HumanAgent(AgentBase):
             # 2. 判断对方是否等待该消息的回复
             if message["waiting"] is not None:
                 # 解析出自己对应的唯一等待ID
-                return_waiting_id = message["waiting"][message["receiver"].index(self.agent_state["agent_id"])]
+                if receiver_index is None:
+                    receiver_index = message["receiver"].index(self.agent_state["agent_id"])
+                return_waiting_id = message["waiting"][receiver_index]
 
             # 将消息添加到 conversation_pool中私聊对话组中
             self.agent_state["conversation_pool"]["conversation_privates"].setdefault(message["sender_id"], {}).setdefault(message["task_id"], []).append(
@@ -313,9 +317,7 @@ class HumanAgent(AgentBase):
             # 清除该stage的所有step
             self.agent_state["agent_step"].remove_step(stage_id=stage_id)
             # 清除相应的工作记忆
-            if task_id in self.agent_state["working_memory"]:
-                if stage_id in self.agent_state["working_memory"][task_id]:
-                    del self.agent_state["working_memory"][task_id][stage_id]
+            self.agent_state["working_memory"].get(task_id, {}).pop(stage_id, None)
 
         # 4. 如果instruction字典包含finish_task的key,提醒人类,并清除该task所有step且清除相应工作记忆
         if instruction and "finish_task" in instruction:
@@ -333,8 +335,7 @@ class HumanAgent(AgentBase):
             # 清除该task的所有step
             self.agent_state["agent_step"].remove_step(task_id=task_id)
             # 清除相应的工作记忆
-            if task_id in self.agent_state["working_memory"]:
-                del self.agent_state["working_memory"][task_id]
+            self.agent_state["working_memory"].pop(task_id, None)
             # 清除私聊会话组中对应task的记录
             for agent_id in self.agent_state["conversation_pool"]["conversation_privates"].keys():
                 if task_id in self.agent_state["conversation_pool"]["conversation_privates"][agent_id].keys():
@@ -44,3 +44,10 @@ class LLMAgent(AgentBase):
         self.agent_state["llm_client"] = LLMClient(self.agent_state["llm_config"])
         # 初始化LLMContext
         self.agent_state["llm_context"] = LLMContext(context_size=15)  # 限制最大轮数为15
+
+    def stop(self):
+        '''
+        停止Agent的执行线程与消息处理线程，并关闭LLM客户端的HTTP会话，释放连接池中的连接
+        '''
+        super().stop()
+        self.agent_state["llm_client"].close()
@@ -38,6 +38,15 @@ class StageState:
     其他:
         on_stage_complete (Optional[Callable]): 阶段完成时的回调函数，用于向task_state提交阶段完成情况
     '''
+    state_kind = "stage"  # 状态监控器中的状态类别
+
+    # 固定属性集合，不为每个stage实例创建__dict__（_state_id 由StateMonitor在注册时写入）
+    __slots__ = (
+        "task_id", "stage_id", "stage_intention", "agent_allocation",
+        "execution_state", "every_agent_state", "completion_summary",
+        "on_stage_complete",
+        "_state_id",
+    )
 
     def __init__(
         self,
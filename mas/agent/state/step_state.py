@@ -4,7 +4,10 @@ Agent被分配执行或协作执行一个阶段时，Agent会为自己规划数
 
 具体实现:封装一个AgentStep类，该类用于管理其内部的step_state的列表
 '''
+import sys
 import uuid
+import itertools
+import queue
 from typing import Any, Dict, Iterable, List, Optional, Type, TypeVar, Union
 from collections import deque
 import threading
@@ -40,6 +43,15 @@ class StepState:
               在工具调用前一步的instruction_generation会负责生成具体的工具调用命令。
         execute_result (Dict[str, Any]): 用来记录LLM输出解析或工具返回的结果，主要作用是向reflection反思模块提供每个步骤的执行信息
     '''
+    state_kind = "step"  # 状态监控器中的状态类别
+
+    # 固定属性集合，不为每个step实例创建__dict__（_state_id 由StateMonitor在注册时写入）
+    __slots__ = (
+        "task_id", "stage_id", "agent_id", "step_id", "step_intention",
+        "type", "executor", "execution_state",
+        "text_content", "instruction_content", "execute_result",
+        "_state_id",
+    )
 
     def __init__(
         self,
@@ -64,8 +76,10 @@ class StepState:
         self.step_intention = step_intention
 
         # step执行属性（具体执行模块，执行状态）
-        self.type = type  # 'skill' or 'tool'
-        self.executor = executor  # 执行该步骤的对象
+        # type与executor取值集合很小且在路由分发时反复作为键比较，驻留后相同取值共享同一字符串对象
+        # （LLM规划出的非法取值不在此处报错，留给Router在执行该step时报错）
+        self.type = sys.intern(type) if isinstance(type, str) else type  # 'skill' or 'tool'
+        self.executor = sys.intern(executor) if isinstance(executor, str) else executor  # 执行该步骤的对象
         self.execution_state = execution_state  # 'init', 'pending', 'running', 'finished', 'failed'
 
         # step内容
@@ -102,8 +116,12 @@ class AgentStep:
         self.agent_id = agent_id
         self.todo_list = deque()  # 只存放待执行的 step_id，执行者从队列里取出任务进行处理，一旦执行完就不会再回到 todo_list
         self.step_list: List[StepState] = []  # 持续记录所有 StepState，即使执行完毕也不会立即被删除，方便后续查询、状态更新和管理。
+        self._steps_by_id: Dict[str, StepState] = {}  # step_id -> StepState 索引，与step_list同步维护，按step_id查询时无需遍历step_list
+        self._steps_by_stage: Dict[str, List[StepState]] = {}  # stage_id -> 该stage下的StepState列表，顺序与step_list一致，按stage_id查询时无需遍历step_list
 
         self.todo_lock = threading.Lock()  # 用于保护 todo_list 的并发修改
+        self.todo_not_empty = threading.Condition(self.todo_lock)  # todo_list 中有新元素时唤醒阻塞在 pop_todo 的执行线程
+
     # 添加step
     def add_step(self, step: StepState):
         """
@@ -111,17 +129,39 @@ class AgentStep:
         如果 step 未被执行过，则自动添加到待执行队列todo_list
         """
         self.step_list.append(step)
+        self._steps_by_id[step.step_id] = step
+        self._steps_by_stage.setdefault(step.stage_id, []).append(step)
         # 如果step未被执行过，则添加到待执行队列
         if step.execution_state not in ["finished", "failed"]:
-            self.todo_list.append(step.step_id)
+            with self.todo_lock:
+                self.todo_list.append(step.step_id)
+                self.todo_not_empty.notify()
             # print(f"[AgentStep] step {step.step_id} 已添加到todo_list")
 
+    def add_steps(self, steps: List[StepState]):
+        """
+        批量添加多个 step 到队列末尾，顺序与传入列表一致
+        与逐个调用 add_step 等价，但 step_list 一次性扩展，todo_list 只加锁一次
+        """
+        self.step_list.extend(steps)
+        for step in steps:
+            self._steps_by_id[step.step_id] = step
+            self._steps_by_stage.setdefault(step.stage_id, []).append(step)
+        # 未被执行过的step批量添加到待执行队列
+        todo_ids = [step.step_id for step in steps if step.execution_state not in ["finished", "failed"]]
+        if todo_ids:
+            with self.todo_lock:
+                self.todo_list.extend(todo_ids)
+                self.todo_not_empty.notify()
+
     def add_next_step(self, step: StepState):
         """
         将step插入到todo_list队列的最前面，优先执行
         也会同步添加到step_list中（保证step_list中待执行的step顺序和todo_list一致）
         """
         # 使用锁保护 todo_list 的并发修改
+        # step_list 的插入也在锁内完成，并在插入之后才唤醒执行线程，
+        # 保证执行线程从 todo_list 取到该 step_id 时，一定能在 step_list 中找到对应的 StepState
         with self.todo_lock:
             assert step.execution_state not in ["finished", "failed"]
             # 插入step到todo_list的队首
@@ -131,13 +171,48 @@ class AgentStep:
             # 获取插入之后 todo_list 的长度
             len_todo = len(self.todo_list)
 
-        # 根据插入之后todo_list的长度来判断StepState应当插入在倒序第几的位置
-        # 反向查找第 len_todo -1 个未完成的 step
-        insert_index = max(0, len(self.step_list) - (len_todo - 1))
-
-        self.step_list.insert(insert_index, step)
+            # 根据插入之后todo_list的长度来判断StepState应当插入在倒序第几的位置
+            # 反向查找第 len_todo -1 个未完成的 step
+            insert_index = max(0, len(self.step_list) - (len_todo - 1))
+
+            # stage索引中插在同stage的后一个step之前，insert_index之后只有待执行的step，查找范围很小
+            stage_steps = self._steps_by_stage.setdefault(step.stage_id, [])
+            following = next((s for s in itertools.islice(self.step_list, insert_index, None) if s.stage_id == step.stage_id), None)
+            if following is None:
+                stage_steps.append(step)
+            else:
+                stage_steps.insert(stage_steps.index(following), step)
+
+            self.step_list.insert(insert_index, step)
+            self._steps_by_id[step.step_id] = step
+            self.todo_not_empty.notify()
         return step.step_id
 
+    # 取出待执行的step
+    def pop_todo(self, block: bool = True, timeout: Optional[float] = None) -> str:
+        """
+        从todo_list队首取出一个待执行的step_id，队列为空时阻塞等待，直到有新的step被添加
+        与 queue.Queue.get 语义一致：
+        - block为False时不等待，队列为空直接抛出 queue.Empty
+        - 如果指定了timeout且超时仍没有新的step，则抛出 queue.Empty
+        """
+        with self.todo_not_empty:
+            if block:
+                has_todo = self.todo_not_empty.wait_for(lambda: self.todo_list, timeout=timeout)
+            else:
+                has_todo = bool(self.todo_list)
+            if not has_todo:
+                raise queue.Empty
+            return self.todo_list.popleft()
+
+    def get_todo_snapshot(self) -> List[str]:
+        """
+        在锁内复制一份当前待执行的step_id列表，供其他线程（如状态监控）只读遍历
+        直接遍历todo_list可能与执行线程的出队/入队并发，导致 deque mutated during iteration
+        """
+        with self.todo_lock:
+            return list(self.todo_list)
+
     # 移除step
     def remove_step(
         self,
@@ -148,6 +223,7 @@ class AgentStep:
         """
         根据 step_id 或 task_id 或 stage_id 移除 step
         如果是 task_id 或 stage_id，会移除所有对应的step
+        被移除的step若仍在todo_list中等待执行，也会一并从todo_list中移除
         """
         if step_id:
             self.step_list = [step for step in self.step_list if step.step_id != step_id]
@@ -155,6 +231,19 @@ class AgentStep:
             self.step_list = [step for step in self.step_list if step.task_id != task_id]
         elif stage_id:
             self.step_list = [step for step in self.step_list if step.stage_id != stage_id]
+        else:
+            return
+        # 同步重建step_id索引和stage索引
+        self._steps_by_id = {step.step_id: step for step in self.step_list}
+        self._steps_by_stage = {}
+        for step in self.step_list:
+            self._steps_by_stage.setdefault(step.stage_id, []).append(step)
+        # 从todo_list中剔除已被移除的step_id，避免执行线程取到查不到StepState的step_id
+        with self.todo_lock:
+            if any(todo_id not in self._steps_by_id for todo_id in self.todo_list):
+                remaining = [todo_id for todo_id in self.todo_list if todo_id in self._steps_by_id]
+                self.todo_list.clear()
+                self.todo_list.extend(remaining)
 
     # 获取step
     def get_step(
@@ -168,31 +257,60 @@ class AgentStep:
         如果是 task_id 或 stage_id，会返回所有匹配的 step
         """
         if step_id:
-            return [next((step for step in self.step_list if step.step_id == step_id), None)]
+            return [self._steps_by_id.get(step_id)]
         elif stage_id:
-            return [step for step in self.step_list if step.stage_id == stage_id]
+            return list(self._steps_by_stage.get(stage_id, ()))
         elif task_id:
             return [step for step in self.step_list if step.task_id == task_id]
         return []
 
+    def get_step_by_id(self, step_id: str) -> Optional[StepState]:
+        """
+        根据 step_id 直接返回对应的 StepState，不存在时返回None
+        """
+        return self._steps_by_id.get(step_id)
+
+    def get_next_step_in_stage(self, step_id: str, step_type: Optional[str] = None) -> Optional[StepState]:
+        """
+        返回与 step_id 同一stage、排在其之后的第一个step（可按step类型过滤），不存在时返回None
+        只遍历该stage的索引，不遍历整个step_list
+        """
+        step = self._steps_by_id.get(step_id)
+        if step is None:
+            return None
+        stage_steps = self._steps_by_stage.get(step.stage_id, [])
+        try:
+            current_index = stage_steps.index(step)
+        except ValueError:
+            return None
+        return next(
+            (s for s in itertools.islice(stage_steps, current_index + 1, None)
+             if step_type is None or s.type == step_type),
+            None,
+        )
+
     # 更新step状态
     def update_step_status(self, step_id: str, new_state: str):
         """更新 step 执行状态"""
-        step = self.get_step(step_id=step_id)[0]
+        step = self._steps_by_id.get(step_id)
         if step:
             step.update_execution_state(new_state)
 
     # 打印所有step
+    def format_all_steps(self) -> str:
+        """返回所有 step 的详细信息文本"""
+        return "".join(
+            f"Task ID: {step.task_id}, Stage ID: {step.stage_id}, Step ID: {step.step_id}, "
+            f"Execution State: {step.execution_state}, Type: {step.type}, Executor: {step.executor}, "
+            f"Intention: {step.step_intention}, Text Content: {step.text_content}, "
+            f"Instruction Content: {step.instruction_content}, Execute Result: {step.execute_result}"
+            f"\n\n"
+            for step in self.step_list
+        )
+
     def print_all_steps(self):
         """打印所有 step 的详细信息"""
-        for step in self.step_list:
-            print(
-                f"Task ID: {step.task_id}, Stage ID: {step.stage_id}, Step ID: {step.step_id}, "
-                f"Execution State: {step.execution_state}, Type: {step.type}, Executor: {step.executor}, "
-                f"Intention: {step.step_intention}, Text Content: {step.text_content}, "
-                f"Instruction Content: {step.instruction_content}, Execute Result: {step.execute_result}"
-                f"\n"
-            )
+        print(self.format_all_steps(), end="")
 
 if __name__ == "__main__":
     '''
@@ -238,12 +356,12 @@ if __name__ == "__main__":
     agent_step.add_step(step3)
 
     print("此时取出一个todo_list的元素")
-    agent_step.todo_list.popleft()
+    agent_step.pop_todo()
 
     print("插入步骤四")
     agent_step.add_next_step(step4)
     # 打印todo_list
-    print("当前todo_list:", list(agent_step.todo_list))
+    print("当前todo_list:", agent_step.get_todo_snapshot())
     agent_step.print_all_steps()
 
 
@@ -21,8 +21,12 @@ import json
 import os
 import yaml
 from pathlib import Path
+import threading
 import weakref
 
+# 读取YAML时优先使用libyaml的C解析器
+_YAML_LOADER = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
 
 
 class SyncState:
@@ -42,6 +46,9 @@ class SyncState:
         self._agents = []
         # 保存对 MultiAgentSystem 的引用
         self.system = system
+        # 多个Agent的执行线程会并发调用sync_state，用同一把锁串行化对task_state/stage_state的更新
+        # 使用可重入锁，sync_state内部的任务操作（如创建Agent、启动阶段）可能再次进入SyncState
+        self._lock = threading.RLock()
 
     def load_yaml_recursive(self, root_dir):
         """
@@ -58,7 +65,7 @@ class SyncState:
             if file_path.suffix.lower() in ('.yaml', '.yml'):
                 try:
                     with open(file_path, 'r', encoding='utf-8') as f:
-                        data = yaml.safe_load(f)
+                        data = yaml.load(f, Loader=_YAML_LOADER)
                         yield str(file_path), data
                 except yaml.YAMLError as e:
                     print(f"[YAML解析错误] {file_path}: {e}")
@@ -258,8 +265,23 @@ class SyncState:
         # 将构造好的消息放入任务的通信队列中
         task_state.communication_queue.put(message)
 
-    # 实现解析executor_output并更新task/stage状态
     def sync_state(self, executor_output: Dict[str, any]):
+        '''
+        解析执行器返回的输出结果 executor_output ，更新任务状态与阶段状态（持有同步锁）
+        '''
+        with self._lock:
+            self._apply(executor_output)
+
+    def sync_state_many(self, executor_outputs: Iterable[Dict[str, any]]):
+        '''
+        按顺序应用多个执行器输出，只获取一次同步锁
+        '''
+        with self._lock:
+            for executor_output in executor_outputs:
+                self._apply(executor_output)
+
+    # 实现解析executor_output并更新task/stage状态
+    def _apply(self, executor_output: Dict[str, any]):
         '''
         解析执行器返回的输出结果 executor_output ，更新任务状态与阶段状态。
         一般情况下只有 任务管理Agent 会变更任务状态与阶段状态。
@@ -767,7 +789,7 @@ class SyncState:
                     try:
                         # 打开该 YAML 文件并读取内容，使用 utf-8 编码
                         with open(fpath, 'r', encoding='utf-8') as f:
-                            ydata = yaml.safe_load(f)
+                            ydata = yaml.load(f, Loader=_YAML_LOADER)
                             return_ask_info_md.append(f"#### Agent配置: {file_name}\n")
                             # 遍历需要展示的关键字段：
                             for key in ['name', 'role', 'profile', 'skills', 'tools']:
@@ -35,6 +35,7 @@ class TaskState:
         共享消息池是各个Agent完成自己step后同步的简略信息，且共享消息池的信息所有Agent可主动访问，但是不会一有新消息就增量通知Agent。Agent可以不感知共享消息池的变化。
         通讯消息队列是Agent之间相互发送的待转发的消息，里面存放的是Agent主动发起的通讯请求，里面必然包含需要其他Agent及时回复/处理的消息。
     '''
+    state_kind = "task"  # 状态监控器中的状态类别
 
     def __init__(
         self,
@@ -1,13 +1,34 @@
 import os
+import re
 import importlib
 
-# 自动导入当前目录下的所有技能模块，确保所有技能触发向executor注册
+from mas.agent.base.executor_base import Executor
+
+# 匹配技能模块中的注册装饰器与紧随其后的类定义，例如:
+# @Executor.register(executor_type="skill", executor_name="planning")
+# class PlanningSkill(Executor):
+REGISTER_PATTERN = re.compile(
+    r"^@Executor\.register\(\s*(?:executor_type\s*=\s*)?[\"'](\w+)[\"']\s*,\s*"
+    r"(?:executor_name\s*=\s*)?[\"'](\w+)[\"']\s*\)[ \t]*(?:#[^\n]*)?\nclass\s+(\w+)",
+    re.MULTILINE,
+)
+
+# 自动注册当前目录下的所有技能模块，确保所有技能向executor注册
+# 从模块源码中读取注册装饰器，只向executor登记模块路径（延迟注册），技能第一次被路由时才导入对应模块
+# 无法从源码中完整识别注册信息的模块（例如动态注册）则直接导入，触发其register装饰器
 def auto_import_skills():
     current_dir = os.path.dirname(__file__)
     for filename in os.listdir(current_dir):
         if filename.endswith(".py") and filename != "__init__.py":
             module_name = f"mas.skills.{filename[:-3]}"
-            importlib.import_module(module_name)
+            with open(os.path.join(current_dir, filename), "r", encoding="utf-8") as f:
+                source = f.read()
+            registrations = REGISTER_PATTERN.findall(source)
+            if registrations and len(registrations) == source.count("@Executor.register("):
+                for executor_type, executor_name, class_name in registrations:
+                    Executor.register_lazy(executor_type, executor_name, f"{module_name}:{class_name}")
+            else:
+                importlib.import_module(module_name)
 
 # 在模块导入时自动触发
-auto_import_skills()
\ No newline at end of file
+auto_import_skills()
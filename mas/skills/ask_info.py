@@ -264,7 +264,8 @@ class AskInfoSkill(Executor):
             # 5. 添加通信等待机制的步骤锁
             # 生成唯一等待标识ID，直到SyncState回复消息中包含该ID（Agent回收步骤锁后），Agent才可进行后续step执行。
             waiting_id = str(uuid.uuid4())
-            agent_state["step_lock"].append(waiting_id)  # 添加等待标识ID到步骤锁列表中
+            with self.state_lock(agent_state, "step_lock"):
+                agent_state["step_lock"].add(waiting_id)  # 添加等待标识ID到步骤锁集合中
             # 将等待标识ID添加到ask_instruction中
             ask_instruction["waiting_id"] = waiting_id
 
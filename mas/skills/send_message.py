@@ -443,7 +443,8 @@ class SendMessageSkill(Executor):
                 waiting_id_list = [str(uuid.uuid4()) for _ in message["receiver"]]
                 # 将全部唯一等待标识ID添加到agent_state["step_lock"]中，
                 # 在Agent回收全部标识ID（收到包含标识ID的信息）前，步骤锁一直生效，暂停后续step的执行。
-                agent_state["step_lock"].extend(waiting_id_list)
+                with self.state_lock(agent_state, "step_lock"):
+                    agent_state["step_lock"].update(waiting_id_list)
 
                 # 将消息中的["waiting"]字段替换为生成的唯一等待ID
                 message["waiting"] = waiting_id_list
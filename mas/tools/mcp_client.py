@@ -47,6 +47,9 @@ from mcp.client.session import ClientSession
 from mcp.client.sse import sse_client
 from mcp.client.stdio import StdioServerParameters, stdio_client
 
+# 有libyaml时使用CSafeLoader解析工具配置
+_YAML_LOADER = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
 # 配置日志级别，忽略 MCP 通知验证的 WARNING 消息，但保留 ERROR 级别的消息
 logging.getLogger().setLevel(logging.ERROR)
 
@@ -180,7 +183,7 @@ class MCPClient:
                 file_path = os.path.join(config_dir, filename)
                 try:
                     with open(file_path, 'r', encoding='utf-8') as f:
-                        yaml_data = yaml.safe_load(f)
+                        yaml_data = yaml.load(f, Loader=_YAML_LOADER)
 
                     # tool_name = yaml_data.get("use_guide", "").get("tool_name", "").strip()
                     config_str = yaml_data.get("config", "").strip()
@@ -31,11 +31,12 @@ class MessageDispatcher(threading.Thread):
                     delivered = False  # 标记消息是否成功分发给至少一个接收者
 
                     # 分发消息给对应的 Agent
-                    for agent_id in agent_id_list:
+                    # 同时传入接收者在receiver列表中的位置，接收者解析唯一等待ID时无需再线性查找自己的位置
+                    for receiver_index, agent_id in enumerate(agent_id_list):
                         if agent_id in agent_dict:
                             agent = agent_dict[agent_id]
                             # 这里调用Agent的receive_message方法来处理消息
-                            agent.receive_message(message)
+                            agent.receive_message(message, receiver_index=receiver_index)
                             delivered = True
                             print(f"[MessageDispatcher] 消息已分发给 Agent {agent_id}")
                         else:
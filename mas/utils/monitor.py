@@ -18,6 +18,27 @@ from typing import Dict, Any, List, Optional, Type, TypeVar, Union
 import queue
 from collections import deque
 
+# 状态类别，注册时按类别分区存放，按类别查询时只遍历对应分区
+STATE_KINDS = ("task", "stage", "agent", "step")
+
+
+def get_state_kind(instance, state_id: str) -> Optional[str]:
+    '''
+    获取状态实例的类别（task / stage / agent / step），无法归类时返回None
+    优先使用类属性 state_kind（子类会继承，例如AgentBase的所有子类均为agent），
+    未声明 state_kind 的类按 state_id 前缀归类：以类别名开头，或以 llm / human 开头的归为agent
+    '''
+    kind = getattr(type(instance), "state_kind", None)
+    if kind in STATE_KINDS:
+        return kind
+    lowered = state_id.lower()
+    for kind in STATE_KINDS:
+        if lowered.startswith(kind):
+            return kind
+    if lowered.startswith(("llm", "human")):
+        return "agent"
+    return None
+
 class StateMonitor:
     """
     状态监控器，负责装饰类、注册实例、提供状态查询
@@ -32,6 +53,7 @@ class StateMonitor:
         if cls._instance is None:
             cls._instance = super().__new__(cls)
             cls._instance._registry = {}  # 用于注册所有被追踪的类实例（状态实例）
+            cls._instance._kind_registry = {}  # 按状态类别分区的注册表 {<kind>: {state_id: 实例}}
             cls._instance._lock = threading.Lock()  # 多线程安全锁
         return cls._instance
 
@@ -58,6 +80,9 @@ class StateMonitor:
             # 将该实例注册到监控器的注册表中
             with self._lock:
                 self._registry[state_id] = instance
+                kind = get_state_kind(instance, state_id)
+                if kind is not None:
+                    self._kind_registry.setdefault(kind, {})[state_id] = instance
 
         # 自定义属性设置逻辑（保留普通设置行为，可扩展为触发事件或记录）
         def custom_setattr(instance, name, value):
@@ -65,10 +90,14 @@ class StateMonitor:
             # 可选：这里可以加回调或事件钩子
             # print(f"[{instance._state_id}] 属性更新: {name} = {value}")
 
-        # 将对象转为字典形式，排除私有变量
+        # 将对象转为字典形式，排除私有变量（兼容定义了 __slots__ 而没有 __dict__ 的类）
         def as_dict(instance):
+            if hasattr(instance, "__dict__"):
+                items = instance.__dict__.items()
+            else:
+                items = ((k, getattr(instance, k)) for k in type(instance).__slots__ if hasattr(instance, k))
             return {
-                k: v for k, v in instance.__dict__.items()
+                k: v for k, v in items
                 if not k.startswith("_")
             }
 
@@ -85,6 +114,9 @@ class StateMonitor:
                 return f"{cls_name}_{cls_instance.agent_id}"
             elif cls_name == 'HumanAgent' and hasattr(cls_instance, 'agent_id'):
                 return f"{cls_name}_{cls_instance.agent_id}"
+            elif getattr(cls_instance, 'state_kind', None) == 'agent' and hasattr(cls_instance, 'agent_id'):
+                # 其他Agent子类
+                return f"{cls_name}_{cls_instance.agent_id}"
             else:
                 raise AttributeError(f"{cls_name} 未定义合适的 ID 属性")
 
@@ -105,6 +137,25 @@ class StateMonitor:
                 for state_id, state in self._registry.items()
             }
 
+    def get_states_by_kind(self, kind: str) -> Dict[str, Any]:
+        """
+        获取指定类别（task / stage / agent / step）的所有实例状态，返回字典：{state_id: 属性字典}
+        只序列化该类别的实例，不遍历其他类别（例如查询agent时不序列化所有step）
+        """
+        with self._lock:
+            return {
+                state_id: self._safe_serialize(state)
+                for state_id, state in self._kind_registry.get(kind, {}).items()
+            }
+
+    def get_serialized_state(self, state_id: str) -> Optional[Any]:
+        """
+        获取指定 state_id 的可序列化状态内容，不存在时返回None
+        """
+        with self._lock:
+            inst = self._registry.get(state_id)
+            return self._safe_serialize(inst) if inst is not None else None
+
     def get_state(self, state_id: str) -> Any:
         """
         获取指定 state_id 的状态内容（属性字典）
@@ -268,7 +319,7 @@ class StateMonitor:
                 "persistent_memory": agent_state.get("persistent_memory"),
                 "agent_step": {
                     "step_list": self._safe_serialize(agent_state.get("agent_step").step_list),
-                    "todo_list": self._safe_serialize(agent_state.get("agent_step").todo_list),
+                    "todo_list": agent_state.get("agent_step").get_todo_snapshot(),
                 } if isinstance(agent_state, dict) else None,
                 "tools": self._safe_serialize(agent_state.get("tools")),
                 "skills": self._safe_serialize(agent_state.get("skills")),
@@ -292,7 +343,7 @@ class StateMonitor:
                 "persistent_memory": agent_state.get("persistent_memory"),
                 "agent_step": {
                     "step_list": self._safe_serialize(agent_state.get("agent_step").step_list),
-                    "todo_list": self._safe_serialize(agent_state.get("agent_step").todo_list),
+                    "todo_list": agent_state.get("agent_step").get_todo_snapshot(),
                 } if isinstance(agent_state, dict) else None,
                 "tools": self._safe_serialize(agent_state.get("tools")),
                 "skills": self._safe_serialize(agent_state.get("skills")),
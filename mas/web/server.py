@@ -109,19 +109,9 @@ def get_states():
     if state_type not in ("task", "stage", "agent", "step"):
         return jsonify({"error": f"Unsupported type '{state_type}'"}), 400
 
-    # 统一获取全部状态（统一结构：{state_id: 内容dict}）
-    all_states: Dict[str, dict] = monitor.get_all_states()
-    # print("[DEBUG] all state ids:", list(all_states.keys()))  # Debug: 打印所有状态 ID
-    # print("[DEBUG] all state ", all_states)
-
-    # 过滤匹配类型:通过状态 ID 前缀匹配（如 TaskState_）
-    result = {}
-    for state_id, state_dict in all_states.items():
-        if state_id.lower().startswith(f"{state_type}"):
-            result[state_id] = state_dict
-        # 增加HumanAgent和LLMAgent筛选逻辑
-        elif state_type == "agent" and state_id.lower().startswith(("llm", "human")):
-            result[state_id] = state_dict
+    # 只获取并序列化该类型的状态（统一结构：{state_id: 内容dict}）
+    # agent类型包含HumanAgent和LLMAgent
+    result: Dict[str, dict] = monitor.get_states_by_kind(state_type)
 
     # 返回 JSON 格式的结果
     return result
@@ -141,13 +131,13 @@ def get_state_detail(state_id):
         "StateID_1": { "task_id": "...", "task_name": "...", ... }
     }
     """
-    all_states: Dict[str, dict] = monitor.get_all_states()
+    state = monitor.get_serialized_state(state_id)
 
-    if state_id not in all_states:
+    if state is None:
         return jsonify({"error": f"State ID '{state_id}' not found"}), 404
 
     return jsonify({
-        state_id: all_states[state_id]
+        state_id: state
     })
 
 # ===================== 人类操作端路由 =====================